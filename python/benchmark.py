@@ -0,0 +1,302 @@
+from typing import Callable, Dict, List
+import argparse
+import copy
+import importlib
+import json
+import random
+import sys
+import time
+import metrics
+import replay
+from object import Object, Reference
+from heap import Heap
+
+# module and constructor options for every collector the suite knows about
+COLLECTORS = {
+    'copying': ('copying', {}),
+    'mark-sweep': ('mark-sweep', {}),
+    'mark-compact': ('mark-compact', {}),
+    'mark-compact-compressor': ('mark-compact', {'mode': 'compressor'}),
+    'mark-compact-threaded': ('mark-compact', {'mode': 'threaded'}),
+    'mark-region': ('mark-region', {}),
+    'generational': ('generational', {}),
+    'reference-counting-simple': ('reference-counting-simple', {}),
+    'reference-counting-complex': ('reference-counting-complex', {}),
+}
+
+# runtimes that only count what is reachable from roots they have been told about
+COUNTING = ('reference-counting-simple', 'reference-counting-complex')
+
+PERCENTILES = ('50', '90', '99', '99.9')
+
+DEFAULT_HEAP_SIZE = 1 << 15
+DEFAULT_SCALE = 10000
+
+
+# the one interface every workload drives, so the same operations reach each
+# runtime. every object a workload still holds on to is a root, moving
+# collectors update roots in place and so the references stay good
+class Mutator:
+    def __init__(self, name: str, runtime):
+        self.name = name
+        self.runtime = runtime
+        self.counting: bool = name in COUNTING
+        self.allocations = 0
+        self.peak_words = 0
+
+    def new(self, obj_id: str, fields: List[str]) -> Reference:
+        ref = self.runtime.new(Object(obj_id, fields))
+        if self.counting:
+            self.runtime.add_root(ref)
+        self.allocated()
+        return ref
+
+    def allocated(self):
+        self.allocations += 1
+        used = sum(heap.size - heap.allocator.free_words for heap in heaps_of(self.runtime))
+        if used > self.peak_words:
+            self.peak_words = used
+
+    def link(self, src: Reference, field: str, target: Reference):
+        self.runtime.set_field(src, field, target)
+
+    def drop(self, obj_id: str):
+        self.runtime.drop(obj_id)
+
+
+# the heaps objects can be allocated in, to-space is left out as it is always empty
+def heaps_of(runtime) -> List[Heap]:
+    if hasattr(runtime, 'old'):
+        return [runtime.old, runtime.from_heap]
+    if hasattr(runtime, 'from_heap'):
+        return [runtime.from_heap]
+    return [runtime.heap]
+
+
+# the heap free space fragments in, the nursery and semispaces are compacted
+# by every collection
+def main_heap_of(runtime) -> Heap:
+    return heaps_of(runtime)[0]
+
+
+# Workloads
+
+# one long list, the tail is the only thing held on to while it grows
+def linked_list(m: Mutator, rnd: random.Random, scale: int):
+    head = m.new('head', ['next'])
+    tail, tail_id = head, 'head'
+    for i in range(scale // 2):
+        node_id = 'l{}'.format(i)
+        node = m.new(node_id, ['next'])
+        m.link(tail, 'next', node)
+        if tail_id != 'head':
+            m.drop(tail_id)
+        tail, tail_id = node, node_id
+    m.drop(tail_id)
+
+# builds a complete binary tree top down, only holding the nodes whose
+# children are still to be built
+def build_tree(m: Mutator, prefix: str, depth: int) -> Reference:
+    root = m.new(prefix, ['left', 'right'])
+    stack = [(root, prefix, depth)]
+    while stack:
+        node, node_id, d = stack.pop()
+        if d > 0:
+            for field in ('left', 'right'):
+                child_id = '{}{}'.format(node_id, field[0])
+                child = m.new(child_id, ['left', 'right'])
+                m.link(node, field, child)
+                stack.append((child, child_id, d - 1))
+        if node_id != prefix:
+            m.drop(node_id)
+    return root
+
+# a long-lived tree alongside a stream of smaller short-lived ones
+def binary_trees(m: Mutator, rnd: random.Random, scale: int):
+    depth = max(scale.bit_length() - 4, 2)
+    build_tree(m, 'long', depth)
+    for i in range(max(4 * scale // 2 ** (depth - 1), 1)):
+        prefix = 't{}'.format(i)
+        build_tree(m, prefix, depth - 2)
+        m.drop(prefix)
+
+# new nodes point at a few older ones from a pool that is held on to, older
+# nodes live on for as long as something newer still reaches them
+def random_dag(m: Mutator, rnd: random.Random, scale: int, width: int = 64, edge_probability: float = 0.4):
+    pool = []
+    for i in range(scale):
+        node_id = 'd{}'.format(i)
+        node = m.new(node_id, ['a', 'b'])
+        for field in ('a', 'b'):
+            if pool and rnd.random() < edge_probability:
+                m.link(node, field, rnd.choice(pool)[1])
+        if len(pool) < width:
+            pool.append((node_id, node))
+        else:
+            victim = rnd.randrange(width)
+            m.drop(pool[victim][0])
+            pool[victim] = (node_id, node)
+
+# rings hung off one anchor, each replaced ring becomes cyclic garbage
+def cyclic_rings(m: Mutator, rnd: random.Random, scale: int, ring_size: int = 8):
+    anchor = m.new('anchor', ['ring'])
+    for r in range(scale // ring_size):
+        first_id = 'r{}.0'.format(r)
+        first = m.new(first_id, ['next'])
+        m.link(anchor, 'ring', first)
+        tail, tail_id = first, first_id
+        for i in range(1, ring_size):
+            node_id = 'r{}.{}'.format(r, i)
+            node = m.new(node_id, ['next'])
+            m.link(tail, 'next', node)
+            if tail_id != first_id:
+                m.drop(tail_id)
+            tail, tail_id = node, node_id
+        m.link(tail, 'next', first)
+        m.drop(tail_id)
+        m.drop(first_id)
+
+# lots of objects that die young, only the most recent `live` are held
+def churn(m: Mutator, rnd: random.Random, scale: int, live: int = 64):
+    held = []
+    for i in range(scale * 4):
+        node_id = 'c{}'.format(i)
+        node = m.new(node_id, ['next'])
+        if held:
+            m.link(node, 'next', held[-1][1])
+        held.append((node_id, node))
+        if len(held) > live:
+            m.drop(held.pop(0)[0])
+            # the new oldest must not keep the dropped one alive
+            m.link(held[0][1], 'next', None)
+
+# a big set of long-lived lists that every tracing collection has to walk
+# again, with short-lived allocation on top
+def large_working_set(m: Mutator, rnd: random.Random, scale: int, lists: int = 16):
+    anchor = m.new('ws', ['f{}'.format(i) for i in range(lists)])
+    for l in range(lists):
+        head_id = 'ws{}.0'.format(l)
+        head = m.new(head_id, ['next', 'value'])
+        m.link(anchor, 'f{}'.format(l), head)
+        tail, tail_id = head, head_id
+        for i in range(1, scale // 4 // lists):
+            node_id = 'ws{}.{}'.format(l, i)
+            node = m.new(node_id, ['next', 'value'])
+            m.link(tail, 'next', node)
+            m.drop(tail_id)
+            tail, tail_id = node, node_id
+        m.drop(tail_id)
+    churn(m, rnd, scale // 2, live = 16)
+
+WORKLOADS: Dict[str, Callable[[Mutator, random.Random, int], None]] = {
+    'random-dag': random_dag,
+    'linked-list': linked_list,
+    'binary-trees': binary_trees,
+    'cyclic-rings': cyclic_rings,
+    'churn': churn,
+    'large-working-set': large_working_set,
+}
+
+
+# runs `workload`, or when `trace` is given replays that trace file instead.
+# the runtime's metrics as they were before the final collection are appended
+# to `measured` when it is given
+def run(collector: str, workload: str, scale: int = DEFAULT_SCALE, heap_size: int = DEFAULT_HEAP_SIZE,
+        seed: int = 0, trace: str = None, measured: List = None) -> Dict:
+    module_name, options = COLLECTORS[collector]
+    module = importlib.import_module(module_name)
+    runtime = module.Runtime(heap_size = heap_size, heap_alignment = 1, **options)
+
+    m = Mutator(collector, runtime)
+    error = None
+    start = time.perf_counter()
+    try:
+        if trace is not None:
+            replay.replay(trace, runtime, m.allocated)
+        else:
+            WORKLOADS[workload](m, random.Random(seed), scale)
+    except Exception as e:
+        if str(e) != 'out of memory':
+            raise
+        error = str(e)
+    elapsed = time.perf_counter() - start
+
+    stats = runtime.stats()
+    pauses = stats['pauses']
+    result = {
+        'collector': collector,
+        'workload': workload if trace is None else 'trace:{}'.format(trace),
+        'scale': scale,
+        'heap_size': heap_size,
+        'seed': seed,
+        'allocations': m.allocations,
+        'elapsed': elapsed,
+        'allocations_per_sec': m.allocations / elapsed if elapsed > 0 else 0.0,
+        'gc_time': pauses['total_seconds'],
+        'pauses': pauses['count'],
+        'max_pause': pauses['max_seconds'],
+        'peak_occupancy': m.peak_words / heap_size,
+    }
+    for p in PERCENTILES:
+        result['p{}_pause'.format(p)] = pauses['percentiles'][p]
+    result['phases'] = stats['phases']
+    result['counters'] = stats['counters']
+    if measured is not None:
+        measured.append(({'collector': collector, 'workload': result['workload']}, copy.deepcopy(runtime.metrics)))
+
+    if error is None:
+        runtime.collect()
+        heap = main_heap_of(runtime)
+        result['live_words'] = sum(h.size - h.allocator.free_words for h in heaps_of(runtime))
+        result['fragmentation'] = heap.fragmentation()
+    result['error'] = error
+    return result
+
+def run_suite(collectors: List[str], workloads: List[str], scale: int, heap_size: int, seed: int,
+              measured: List = None) -> List[Dict]:
+    return [run(collector, workload, scale, heap_size, seed, measured = measured)
+            for workload in workloads for collector in collectors]
+
+def report(results: List[Dict]):
+    print('{:<18} {:<27} {:>10} {:>9} {:>7} {:>9} {:>9} {:>6} {:>6}'.format(
+        'workload', 'collector', 'allocs/s', 'gc time', 'pauses', 'p99 ms', 'max ms', 'peak', 'frag'))
+    for r in results:
+        if r['error'] is not None:
+            print('{:<18} {:<27} {}'.format(r['workload'], r['collector'], r['error']))
+            continue
+        print('{:<18} {:<27} {:>10.0f} {:>8.3f}s {:>7} {:>9.3f} {:>9.3f} {:>5.0f}% {:>5.0f}%'.format(
+            r['workload'], r['collector'], r['allocations_per_sec'], r['gc_time'], r['pauses'],
+            r['p99_pause'] * 1000, r['max_pause'] * 1000, r['peak_occupancy'] * 100, r['fragmentation'] * 100))
+
+def main():
+    parser = argparse.ArgumentParser(description = 'runs every collector on the same synthetic workloads')
+    parser.add_argument('--collectors', nargs = '+', choices = list(COLLECTORS), default = list(COLLECTORS))
+    parser.add_argument('--workloads', nargs = '+', choices = list(WORKLOADS), default = list(WORKLOADS))
+    parser.add_argument('--scale', type = int, default = DEFAULT_SCALE)
+    parser.add_argument('--heap-size', type = int, default = DEFAULT_HEAP_SIZE)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--trace', metavar = 'PATH', help = 'replay this mutator trace instead of running the workloads')
+    parser.add_argument('--json', metavar = 'PATH', help = "write the results as JSON to PATH, '-' for stdout")
+    parser.add_argument('--prometheus', metavar = 'PATH', help = 'write every run\'s metrics as Prometheus text to PATH')
+    args = parser.parse_args()
+
+    measured = []
+    if args.trace is not None:
+        results = [run(collector, 'trace', heap_size = args.heap_size, trace = args.trace, measured = measured)
+                   for collector in args.collectors]
+    else:
+        results = run_suite(args.collectors, args.workloads, args.scale, args.heap_size, args.seed, measured)
+    if args.prometheus is not None:
+        with open(args.prometheus, 'w') as out:
+            out.write(metrics.to_prometheus(measured))
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent = 2)
+        print()
+        return
+    if args.json is not None:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent = 2)
+    report(results)
+
+if __name__ == "__main__":
+    main()
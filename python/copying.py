@@ -1,14 +1,33 @@
-from typing import List
+from typing import Dict, List
+import random
 import sys
+import time
+import events
+from metrics import Metrics
+from policy import Policy
 from object import Object, Reference
-from heap import Heap
+from heap import Heap, BUMP
 
+BREADTH_FIRST = 'breadth-first'
+DEPTH_FIRST = 'depth-first'
+HIERARCHICAL = 'hierarchical'
+COPY_ORDERS = (BREADTH_FIRST, DEPTH_FIRST, HIERARCHICAL)
+
+# size of the to-space block scanned ahead of the main scan pointer when
+# copying in hierarchical order
+HIERARCHICAL_BLOCK = 64
 
 class Collector:
-    def __init__(self, from_heap: Heap, to_heap: Heap):
+    def __init__(self, from_heap: Heap, to_heap: Heap, order: str = DEPTH_FIRST, metrics: Metrics = None):
+        if order not in COPY_ORDERS:
+            raise ValueError('unknown copy order: {}, expected one of {}'.format(order, COPY_ORDERS))
+
         self.from_heap: Heap = from_heap
         self.to_heap: Heap = to_heap
+        self.order: str = order
+        # only used when copying depth first, the other orders scan to-space
         self.worklist: List[Reference] = []
+        self.metrics: Metrics = metrics if metrics is not None else Metrics()
 
     def flip_heaps(self):
         temp = self.from_heap
@@ -19,55 +38,132 @@ class Collector:
         return self.from_heap, self.to_heap
 
     def collect(self, roots: List[Reference]):
-        self.worlist: List[Reference] = []
-        for root in roots:
-            root.address = self.forward(root)
-        while self.worklist:
-            ref = self.worklist.pop()
-            obj = self.from_heap.load(ref)
+        with self.metrics.pause:
+            events.emit(events.INFO, events.GC, 'beginning collection')
+            self.worklist = []
+            with self.metrics.phase('copy_roots'):
+                for root in roots:
+                    root.address = self.forward(root)
+
+            with self.metrics.phase('copy'):
+                if self.order == BREADTH_FIRST:
+                    self.cheney_scan()
+                elif self.order == HIERARCHICAL:
+                    self.hierarchical_scan()
+                else:
+                    while self.worklist:
+                        ref = self.worklist.pop()
+                        obj = self.to_heap.load(ref)
+                        self.scan(obj)
+
+            # survivors are the same objects we just copied, so they have to lose
+            # their forwarding address before the next collection looks at them
+            for obj in self.to_heap.objs.values():
+                obj.forwarding_address = None
+            self.count_collection()
+            events.emit(events.INFO, events.GC, 'collection complete, {} words copied', self.to_heap.allocator.top)
+            return self.flip_heaps()
+
+    # to-space holds exactly what was copied, and whatever was not copied out
+    # of from-space is garbage
+    def count_collection(self):
+        self.metrics.count('collections')
+        self.metrics.count('objects_copied', len(self.to_heap.objs))
+        self.metrics.count('words_copied', self.to_heap.allocator.top)
+        self.metrics.count('objects_freed', len(self.from_heap.objs) - len(self.to_heap.objs))
+        self.metrics.count('words_freed', self.from_heap.allocator.top - self.to_heap.allocator.top)
+
+    # the copied objects between `scan` and the to-space bump pointer are the
+    # queue of objects still to scan
+    def cheney_scan(self):
+        scan = 0
+        while scan < self.to_heap.allocator.top:
+            obj = self.to_heap.objs[self.to_heap.contents[scan]]
             self.scan(obj)
-        return self.flip_heaps()
+            scan += obj.size()
+
+    # Moon's approximately depth-first order: before moving the main scan
+    # pointer on, scan whatever has just been copied into the block the bump
+    # pointer is in, so children land close to their parents. objects in that
+    # block get scanned a second time by the main scan, which is harmless as
+    # forwarding a to-space reference is a no-op
+    def hierarchical_scan(self):
+        scan = 0
+        partial = 0
+        while scan < self.to_heap.allocator.top:
+            top = self.to_heap.allocator.top
+            partial = max(partial, scan, top - top % HIERARCHICAL_BLOCK)
+            partial = self.to_heap.starts.find(1, partial, top)
+            if partial != -1:
+                obj = self.to_heap.objs[self.to_heap.contents[partial]]
+                self.scan(obj)
+                partial += obj.size()
+            else:
+                partial = top
+                obj = self.to_heap.objs[self.to_heap.contents[scan]]
+                self.scan(obj)
+                scan += obj.size()
 
     def scan(self, obj: Object):
         for f_name, f_ref in obj.fields.items():
-            obj.fields[f_name].address = self.forward(f_ref)
+            if f_ref is not None:
+                obj.fields[f_name] = Reference(self.forward(f_ref), f_ref.size)
         
     def forward(self, ref: Reference) -> int:
+        if self.to_heap.contains(ref):
+            return ref.address
+
         obj: Object = self.from_heap.load(ref)
         if obj is not None:
             to_addr: int = obj.forwarding_address
             if to_addr is None:
                 to_ref = self.copy(obj)
                 to_addr = to_ref.address
+            elif events.level >= events.TRACE:
+                events.emit(events.TRACE, events.FORWARD, 'obj {} already forwarded to {}', obj.id, to_addr)
             return to_addr
     
     def copy(self, obj: Object) -> Reference:
         to_ref: Reference = self.to_heap.alloc(obj.size())
+        if events.level >= events.DEBUG:
+            events.emit(events.DEBUG, events.COPY, 'copying obj {} of size {} to {}', obj.id, obj.size(), to_ref.address)
         self.to_heap.store(to_ref, obj)
         obj.forwarding_address = to_ref.address
-        self.worklist.append(to_ref)
+        if self.order == DEPTH_FIRST:
+            self.worklist.append(to_ref)
         return to_ref
 
 class Runtime:
-    def __init__(self, heap_size: int, heap_alignment: int):
+    def __init__(self, heap_size: int, heap_alignment: int, order: str = DEPTH_FIRST, policy: Policy = None):
         self.roots: Dict[str, Reference] = {}
+        self.policy: Policy = policy if policy is not None else Policy()
         actual_heap_size = heap_size // 2
-        self.from_heap = Heap(size = actual_heap_size, alignment = heap_alignment)
-        self.to_heap = Heap(size = actual_heap_size, alignment = heap_alignment)
-        self.collector = Collector(self.from_heap, self.to_heap)
+        # the semispaces get separate address ranges so a reference that has
+        # already been forwarded can be told apart from one that hasn't
+        self.from_heap = Heap(size = actual_heap_size, alignment = heap_alignment, policy = BUMP)
+        self.to_heap = Heap(size = actual_heap_size, alignment = heap_alignment, policy = BUMP, base = actual_heap_size)
+        self.metrics = Metrics()
+        self.collector = Collector(self.from_heap, self.to_heap, order, self.metrics)
 
     # Mutator methods
     def new(self, obj: Object) -> Reference:
-        print("attempting to allocate new object of size {}, with id: {}".format(obj.size(), obj.id))
+        if events.level >= events.DEBUG:
+            events.emit(events.DEBUG, events.ALLOC, 'attempting to allocate new object of size {}, with id: {}', obj.size(), obj.id)
 
-        ref = self.from_heap.alloc(obj.size())
+        size = obj.size()
+        if self.policy.should_collect(self.from_heap, size):
+            self.collect_for(size)
+        ref = self.from_heap.alloc(size)
 
         if ref == None:
-            self.collector.collect(self.roots.values())
-            ref = self.from_heap.alloc(obj.size())
+            self.collect_for(size)
+            ref = self.from_heap.alloc(size)
+            if ref == None and self.resize(self.policy.exhausted(self.from_heap, size)):
+                ref = self.from_heap.alloc(size)
             if ref == None:
                 raise Exception("out of memory")
   
+        self.policy.allocated(size)
         self.write(ref, obj)
         self.roots[obj.id] = ref
         return ref
@@ -84,8 +180,39 @@ class Runtime:
         if field not in src_object.fields:
             raise ValueError('unknown field: {} on obj: {}'.format(field, self.id))
 
+        # fields get their own reference so that moving a root in place can't
+        # change what a field points at mid-collection
+        if target is not None:
+            target = Reference(target.address, target.size)
         src_object.fields[field] = target
 
+    def stats(self) -> Dict:
+        return self.metrics.stats()
+
+    # a collection the runtime decided on, the policy gets to resize the
+    # semispaces after it
+    def collect_for(self, size: int):
+        started = time.perf_counter()
+        self.from_heap, self.to_heap = self.collector.collect(self.roots.values())
+        finished = time.perf_counter()
+        self.resize(self.policy.collected(self.from_heap, self.from_heap.live_words, started, finished))
+
+    # sizes both semispaces and returns true if they grew. from-space can't
+    # move, so the empty to-space is placed wherever it doesn't overlap it
+    def resize(self, size: int) -> bool:
+        old_size = self.from_heap.size
+        size = self.from_heap.resize(size)
+        if size == old_size:
+            return False
+        self.to_heap.resize(size)
+        self.to_heap.base = 0 if self.from_heap.base >= size else self.from_heap.base + size
+        return size > old_size
+
+    # the root gets its own reference, like a field does in set_field, so
+    # moving the root in place can't move a field that shared it
+    def add_root(self, ref: Reference):
+        self.roots[self.from_heap.load(ref).id] = Reference(ref.address, ref.size)
+
     def drop(self, obj_id: str):
         if obj_id in self.roots:
             del self.roots[obj_id]
@@ -94,17 +221,61 @@ class Runtime:
             sys.exit(1)
 
     def collect(self):
-        print('heap before collection: ')
-        self.from_heap.visualize()
+        if events.enabled(events.INFO):
+            print('heap before collection: ')
+            self.from_heap.visualize()
         self.from_heap, self.to_heap = self.collector.collect(self.roots.values())
-        print('heap after collection: ')
-        self.from_heap.visualize()
+        if events.enabled(events.INFO):
+            print('heap after collection: ')
+            self.from_heap.visualize()
 
 def main():
+    if sys.argv[1:] == ['compare-orders']:
+        return compare_orders()
+
+    events.configure(events.DEBUG)
     runtime = Runtime(heap_size = 100, heap_alignment = 1)
     build_object_graph(runtime) 
     runtime.collect()
 
+# copies the same scrambled binary tree in each order and reports how far
+# apart parents and children end up
+def compare_orders(depth: int = 10):
+    for order in COPY_ORDERS:
+        runtime = Runtime(heap_size = 2 * 3 * 2 ** (depth + 1), heap_alignment = 1, order = order)
+        build_tree(runtime, depth)
+        runtime.collect()
+        print('{}: mean parent to child distance {:.1f} words'.format(order, mean_edge_distance(runtime.from_heap)))
+
+def mean_edge_distance(heap: Heap) -> float:
+    total = 0
+    edges = 0
+    address = heap.starts.find(1)
+    while address != -1:
+        obj = heap.objs[heap.contents[address]]
+        for f_ref in obj.fields.values():
+            if f_ref is not None:
+                total += abs(f_ref.address - heap.base - address)
+                edges += 1
+        address = heap.starts.find(1, address + obj.size())
+    return total / edges if edges else 0.0
+
+# a complete binary tree whose nodes are allocated in random order, only the
+# root is left as a root
+def build_tree(runtime: Runtime, depth: int):
+    count = 2 ** (depth + 1) - 1
+    order = list(range(count))
+    random.Random(0).shuffle(order)
+    refs = {}
+    for i in order:
+        refs[i] = runtime.new(Object('n{}'.format(i), ['left', 'right']))
+    for i in range(count):
+        if 2 * i + 2 < count:
+            runtime.set_field(refs[i], 'left', refs[2 * i + 1])
+            runtime.set_field(refs[i], 'right', refs[2 * i + 2])
+        if i > 0:
+            runtime.drop('n{}'.format(i))
+
 # builds the following object graph
 #
 #               ROOT (r1)
@@ -0,0 +1,86 @@
+from typing import Deque, List, Optional, Tuple
+import random
+import sys
+from collections import deque
+
+# levels, an event is only recorded when the current level is at least its own
+OFF = 0
+WARN = 1
+INFO = 2
+DEBUG = 3
+TRACE = 4
+
+# kinds of event
+ALLOC = 'alloc'
+FREE = 'free'
+MARK = 'mark'
+COPY = 'copy'
+FORWARD = 'forward'
+SWEEP = 'sweep'
+RC_CHANGE = 'rc-change'
+GC = 'gc'
+
+KINDS = [ALLOC, FREE, MARK, COPY, FORWARD, SWEEP, RC_CHANGE, GC]
+
+# hot paths check this before building an event at all, e.g.
+#
+#     if events.level >= events.DEBUG:
+#         events.emit(events.DEBUG, events.ALLOC, 'allocated {} words at {}', size, address)
+#
+# so a disabled event costs one global load and one comparison
+level: int = WARN
+
+# fraction of the events at or above DEBUG that get recorded, warnings and
+# collection phases are always kept
+sample: float = 1.0
+# when set, events go into this instead of being printed, oldest first out
+ring: Optional[Deque[Tuple[int, str, str, tuple]]] = None
+# kinds to record, None records every kind
+kinds: Optional[frozenset] = None
+
+_random = random.Random(0)
+
+
+def configure(to_level: int = WARN, sample_rate: float = 1.0, ring_size: int = None, only: List[str] = None):
+    global level, sample, ring, kinds
+    level = to_level
+    sample = sample_rate
+    ring = deque(maxlen = ring_size) if ring_size is not None else None
+    kinds = frozenset(only) if only is not None else None
+
+
+def enabled(event_level: int) -> bool:
+    return level >= event_level
+
+
+# the message is only formatted when the event is printed, events in the ring
+# keep their arguments and are formatted on the way out
+def emit(event_level: int, kind: str, message: str, *args):
+    if level < event_level:
+        return
+    if kinds is not None and kind not in kinds:
+        return
+    if event_level >= DEBUG and sample < 1.0 and _random.random() >= sample:
+        return
+    if ring is not None:
+        ring.append((event_level, kind, message, args))
+    else:
+        print(message.format(*args) if args else message)
+
+
+def warn(message: str, *args):
+    emit(WARN, GC, message, *args)
+
+
+# hands back what the ring has captured so far and empties it
+def drain() -> List[Tuple[str, str]]:
+    if ring is None:
+        return []
+    captured = [(kind, message.format(*args) if args else message) for _, kind, message, args in ring]
+    ring.clear()
+    return captured
+
+
+def dump(out = sys.stdout):
+    for kind, message in drain():
+        out.write('[{}] {}\n'.format(kind, message))
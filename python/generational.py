@@ -0,0 +1,303 @@
+from typing import Dict, List
+import importlib
+import sys
+import events
+from metrics import Metrics
+from object import Object, Reference
+from heap import Heap, BUMP
+from copying import Collector, DEPTH_FIRST
+
+mark_sweep = importlib.import_module('mark-sweep')
+
+# words of the old generation covered by one card of the remembered set
+CARD_SIZE = 16
+# minor collections an object has to survive before it is promoted
+PROMOTION_AGE = 2
+
+
+class NurseryCollector(Collector):
+    def __init__(self, from_heap: Heap, to_heap: Heap, old: Heap, cards: bytearray, promotion_age: int,
+                 metrics: Metrics = None):
+        # promoted objects are queued on the worklist, so copy depth first
+        super().__init__(from_heap, to_heap, DEPTH_FIRST, metrics)
+        self.old: Heap = old
+        self.cards: bytearray = cards
+        self.promotion_age: int = promotion_age
+        # minor collections survived so far by each object still in the nursery
+        self.ages: Dict[str, int] = {}
+        self.survivor_ages: Dict[str, int] = {}
+        self.promoted: List[Object] = []
+
+    # only the nursery is traced. the roots and the old objects on dirty cards
+    # are the only ways into it, references into the old generation are left
+    # where they are
+    def collect(self, roots: List[Reference]):
+        self.worklist = []
+        self.survivor_ages = {}
+        self.promoted = []
+        with self.metrics.phase('copy_roots'):
+            for root in roots:
+                if self.from_heap.contains(root):
+                    root.address = self.forward(root)
+            self.scan_cards()
+
+        with self.metrics.phase('copy'):
+            while self.worklist:
+                ref = self.worklist.pop()
+                if self.old.contains(ref):
+                    obj = self.old.load(ref)
+                    self.scan(obj)
+                    self.remember(ref.address - self.old.base, obj)
+                else:
+                    self.scan(self.to_heap.load(ref))
+
+        for obj in self.to_heap.objs.values():
+            obj.forwarding_address = None
+        for obj in self.promoted:
+            obj.forwarding_address = None
+        self.ages = self.survivor_ages
+        self.count_collection()
+        return self.flip_heaps()
+
+    # promoted objects are still in from-space too, but they aren't garbage
+    def count_collection(self):
+        promoted_words = sum(obj.size() for obj in self.promoted)
+        self.metrics.count('minor_collections')
+        self.metrics.count('objects_copied', len(self.to_heap.objs))
+        self.metrics.count('words_copied', self.to_heap.allocator.top)
+        self.metrics.count('objects_promoted', len(self.promoted))
+        self.metrics.count('words_promoted', promoted_words)
+        self.metrics.count('objects_freed', len(self.from_heap.objs) - len(self.to_heap.objs) - len(self.promoted))
+        self.metrics.count('words_freed', self.from_heap.allocator.top - self.to_heap.allocator.top - promoted_words)
+
+    def scan_cards(self):
+        card = self.cards.find(1)
+        while card != -1:
+            self.cards[card] = 0
+            start = card * CARD_SIZE
+            end = min(start + CARD_SIZE, self.old.size)
+            address = self.old.starts.find(1, start, end)
+            while address != -1:
+                obj = self.old.objs[self.old.contents[address]]
+                self.scan(obj)
+                self.remember(address, obj)
+                address = self.old.starts.find(1, address + obj.size(), end)
+            card = self.cards.find(1, card + 1)
+
+    # keeps the card of an old object dirty while it still points into the nursery
+    def remember(self, address: int, obj: Object):
+        for f_ref in obj.fields.values():
+            if f_ref is not None and not self.old.contains(f_ref):
+                self.cards[address // CARD_SIZE] = 1
+                return
+
+    def forward(self, ref: Reference) -> int:
+        if not self.from_heap.contains(ref):
+            return ref.address
+        return super().forward(ref)
+
+    def copy(self, obj: Object) -> Reference:
+        age = self.ages.get(obj.id, 0) + 1
+        if age >= self.promotion_age:
+            to_ref = self.old.alloc(obj.size())
+            if to_ref is not None:
+                if events.level >= events.DEBUG:
+                    events.emit(events.DEBUG, events.COPY, 'promoting obj {} of size {} to {}', obj.id, obj.size(), to_ref.address)
+                self.old.store(to_ref, obj)
+                obj.forwarding_address = to_ref.address
+                self.promoted.append(obj)
+                self.worklist.append(to_ref)
+                return to_ref
+
+        # too young, or the old generation has no room for it until the next
+        # major collection
+        self.survivor_ages[obj.id] = age
+        return super().copy(obj)
+
+
+class Runtime:
+    def __init__(self, heap_size: int, heap_alignment: int, nursery_size: int = None,
+                 promotion_age: int = PROMOTION_AGE):
+        self.roots: Dict[str, Reference] = {}
+        if nursery_size is None:
+            nursery_size = heap_size // 4
+        old_size = heap_size - nursery_size
+        semispace_size = nursery_size // 2
+
+        # old generation first, then the two nursery semispaces, all in one
+        # address space so a reference's address says which heap it is in
+        self.old = Heap(size = old_size, alignment = heap_alignment)
+        self.from_heap = Heap(size = semispace_size, alignment = heap_alignment, policy = BUMP, base = old_size)
+        self.to_heap = Heap(size = semispace_size, alignment = heap_alignment, policy = BUMP, base = old_size + semispace_size)
+        self.cards = bytearray(old_size // CARD_SIZE + 1)
+
+        self.metrics = Metrics()
+        self.nursery = NurseryCollector(self.from_heap, self.to_heap, self.old, self.cards, promotion_age, self.metrics)
+        self.old_collector = mark_sweep.Collector(self.old, bitmap = True, metrics = self.metrics)
+        self.minor_collections = 0
+        self.major_collections = 0
+
+    # Mutator methods
+    def new(self, obj: Object) -> Reference:
+        if events.level >= events.DEBUG:
+            events.emit(events.DEBUG, events.ALLOC, 'attempting to allocate new object of size {}, with id: {}', obj.size(), obj.id)
+
+        ref = self.from_heap.alloc(obj.size())
+        if ref == None:
+            self.minor_collect()
+            ref = self.from_heap.alloc(obj.size())
+
+        if ref == None:
+            # bigger than the nursery has room for, so it starts out old
+            ref = self.old.alloc(obj.size())
+            if ref == None:
+                self.major_collect()
+                ref = self.old.alloc(obj.size())
+                if ref == None:
+                    raise Exception("out of memory")
+
+        self.write(ref, obj)
+        self.roots[obj.id] = ref
+        return ref
+
+    def heap_of(self, ref: Reference) -> Heap:
+        return self.old if self.old.contains(ref) else self.from_heap
+
+    def read(self, ref: Reference) -> Object:
+        return self.heap_of(ref).load(ref)
+
+    def write(self, ref: Reference, obj: Object):
+        self.heap_of(ref).store(ref, obj)
+
+    def set_field(self, src: Reference, field: str, target: Reference):
+        src_object = self.read(src)
+
+        if field not in src_object.fields:
+            raise ValueError('unknown field: {} on obj: {}'.format(field, src_object.id))
+
+        if target is not None:
+            # fields get their own reference since minor collections move
+            # roots in place
+            target = Reference(target.address, target.size)
+            # card marking barrier: old-to-young pointers go in the remembered set
+            if self.old.contains(src) and not self.old.contains(target):
+                self.cards[(src.address - self.old.base) // CARD_SIZE] = 1
+        src_object.fields[field] = target
+
+    def stats(self) -> Dict:
+        return self.metrics.stats()
+
+    # the root gets its own reference, like a field does in set_field, so
+    # moving the root in place can't move a field that shared it
+    def add_root(self, ref: Reference):
+        self.roots[self.read(ref).id] = Reference(ref.address, ref.size)
+
+    def drop(self, obj_id: str):
+        if obj_id in self.roots:
+            del self.roots[obj_id]
+        else:
+            print("attempting to drop object that doesn't exist: {}".format(obj_id))
+            sys.exit(1)
+
+    def minor_collect(self):
+        with self.metrics.pause:
+            events.emit(events.INFO, events.GC, 'beginning minor collection')
+            self.from_heap, self.to_heap = self.nursery.collect(self.roots.values())
+            self.minor_collections += 1
+
+            # make room for the next round of promotions while the nursery can
+            # still hold on to its own survivors
+            if self.old.allocator.free_words < self.from_heap.size:
+                self.major_collect()
+
+    # traces through both generations so that old objects only reachable via
+    # the nursery survive, then sweeps the old generation
+    def major_collect(self):
+        with self.metrics.pause:
+            events.emit(events.INFO, events.GC, 'beginning major collection')
+            with self.metrics.phase('mark'):
+                self.mark_generations()
+            self.old_collector.sweep()
+            self.major_collections += 1
+            self.metrics.count('major_collections')
+
+    def mark_generations(self):
+        collector = self.old_collector
+        collector.marks = bytearray(self.old.size)
+        visited_young = set()
+        objects = 0
+        words = 0
+        worklist: List[Reference] = list(self.roots.values())
+        while worklist:
+            ref = worklist.pop()
+            if self.old.contains(ref):
+                obj = self.old.load(ref)
+                if collector.is_marked(ref, obj):
+                    continue
+                collector.set_mark(ref, obj)
+            elif ref.address in visited_young:
+                continue
+            else:
+                visited_young.add(ref.address)
+                obj = self.from_heap.load(ref)
+
+            objects += 1
+            words += obj.size()
+            for f_ref in obj.fields.values():
+                if f_ref is not None:
+                    worklist.append(f_ref)
+        self.metrics.count('objects_visited', objects)
+        self.metrics.count('words_visited', words)
+
+    def collect(self):
+        if events.enabled(events.INFO):
+            print('heap before collection: ')
+            self.old.visualize()
+            self.from_heap.visualize()
+        self.major_collect()
+        self.minor_collect()
+        if events.enabled(events.INFO):
+            print('heap after collection: ')
+            self.old.visualize()
+            self.from_heap.visualize()
+
+def main():
+    events.configure(events.DEBUG)
+    runtime = Runtime(heap_size = 100, heap_alignment = 1)
+    build_object_graph(runtime)
+    runtime.collect()
+
+# builds the following object graph
+#
+#               ROOT (r1)
+#              /         \
+#             a1         a2
+#            /  \
+#           b1   b2
+#                          c <- this should get collected
+def build_object_graph(runtime: Runtime):
+    r1 = runtime.new(Object('r1', ['a1', 'a2']))
+
+    a1 = runtime.new(Object('a1', ['b1', 'b2']))
+    a2 = runtime.new(Object('a2', []))
+
+    b1 = runtime.new(Object('b1', []))
+    b2 = runtime.new(Object('b2', []))
+
+    # this should get collected
+    c = runtime.new(Object("c", []))
+
+    runtime.set_field(r1, 'a1', a1)
+    runtime.set_field(r1, 'a2', a2)
+
+    runtime.set_field(a1, 'b1', b1)
+    runtime.set_field(a1, 'b2', b2)
+
+    runtime.drop('a1')
+    runtime.drop('a2')
+    runtime.drop('b2')
+    runtime.drop('c')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,64 +1,622 @@
-from typing import List
+from typing import Dict, Iterator, List, Tuple
+import re
 import shutil
-from functools import reduce
+import sys
+import time
+import events
+from array import array
+from bisect import bisect_left, insort
 from object import Object, Reference
 
 
+# cell values in Heap.contents, anything positive is an object handle
+FREE = 0
+ALLOCATED = -1
+
+FIRST_FIT = 'first-fit'
+BEST_FIT = 'best-fit'
+NEXT_FIT = 'next-fit'
+BUMP = 'bump'
+LINES = 'lines'
+FIT_POLICIES = (FIRST_FIT, BEST_FIT, NEXT_FIT)
+ALLOCATION_POLICIES = FIT_POLICIES + (BUMP, LINES)
+
+# words per line and per block of the line allocator, Immix's 128 byte lines
+# and 32KiB blocks scaled down to heaps of a few thousand words
+LINE_SIZE = 8
+BLOCK_SIZE = 256
+
+# words per region the heap visualizer draws and diffs separately
+VISUALIZER_REGION = 1024
+CELL_RUN = re.compile(rb'(.{8})\1*', re.DOTALL)
+
+# free blocks in size class k have a size in [2^k, 2^(k+1)), the last class
+# holds everything bigger than that
+NUM_SIZE_CLASSES = 16
+
+
+def size_class(size: int) -> int:
+    return min(size.bit_length() - 1, NUM_SIZE_CLASSES - 1)
+
+
+class FreeListAllocator:
+    def __init__(self, size: int, policy: str = FIRST_FIT):
+        if policy not in FIT_POLICIES:
+            raise ValueError('unknown allocation policy: {}, expected one of {}'.format(policy, FIT_POLICIES))
+
+        self.size = size
+        self.policy = policy
+        self.clear()
+
+    def clear(self):
+        self.rebuild([(0, self.size)])
+
+    def rebuild(self, free_ranges: List[Tuple[int, int]]):
+        self.starts: Dict[int, int] = {} # block start to block size
+        self.ends: Dict[int, int] = {}   # block end to block start
+        self.classes: List[List[int]] = [[] for _ in range(NUM_SIZE_CLASSES)] # sorted block starts
+        self.rover: int = 0
+        self.free_words: int = 0
+        # None once the largest block has gone, until someone asks again
+        self.largest: int = 0
+        for start, size in free_ranges:
+            self.free(start, size)
+
+    @property
+    def free_runs(self) -> int:
+        return len(self.starts)
+
+    # the smallest size the allocator can shrink to, only a free block at
+    # the very end can be given up
+    def shrink_limit(self) -> int:
+        return self.ends.get(self.size, self.size)
+
+    def resize(self, size: int):
+        if size > self.size:
+            old_size = self.size
+            self.size = size
+            self.free(old_size, size - old_size)
+        elif size < self.size:
+            start = self.ends[self.size]
+            self.free_words -= self.remove(start)
+            self.size = size
+            if size > start:
+                self.free_words += size - start
+                self.insert(start, size - start)
+
+    # only the highest non-empty size class can hold the largest block, so
+    # that is all that is looked at when it has to be found again
+    @property
+    def largest_free_block(self) -> int:
+        if self.largest is None:
+            blocks = next((blocks for blocks in reversed(self.classes) if blocks), [])
+            self.largest = max((self.starts[start] for start in blocks), default = 0)
+        return self.largest
+
+    # free blocks per size class
+    def histogram(self) -> List[int]:
+        return [len(blocks) for blocks in self.classes]
+
+    def alloc(self, size: int) -> int:
+        k = size_class(size)
+        if self.policy == BEST_FIT:
+            start = self.best_fit(size, k)
+        elif self.policy == NEXT_FIT:
+            start = self.next_fit(size, k)
+        else:
+            start = self.first_fit(size, k)
+
+        if start is None:
+            return None
+
+        block_size = self.remove(start)
+        if block_size > size:
+            self.insert(start + size, block_size - size)
+        self.free_words -= size
+        self.rover = start + size
+        return start
+
+    def free(self, start: int, size: int):
+        if size <= 0:
+            return
+        self.free_words += size
+
+        # coalesce with the free blocks directly before and after this one
+        if start in self.ends:
+            prev_start = self.ends[start]
+            size += self.remove(prev_start)
+            start = prev_start
+        if start + size in self.starts:
+            size += self.remove(start + size)
+
+        self.insert(start, size)
+
+    def first_fit(self, size: int, k: int) -> int:
+        for start in self.classes[k]:
+            if self.starts[start] >= size:
+                return start
+        for blocks in self.classes[k + 1:]:
+            if blocks:
+                return blocks[0]
+        return None
+
+    def best_fit(self, size: int, k: int) -> int:
+        for blocks in self.classes[k:]:
+            best = None
+            for start in blocks:
+                block_size = self.starts[start]
+                if block_size >= size and (best is None or block_size < self.starts[best]):
+                    best = start
+                    if block_size == size:
+                        return best
+            if best is not None:
+                return best
+        return None
+
+    def next_fit(self, size: int, k: int) -> int:
+        for blocks in self.classes[k:]:
+            i = bisect_left(blocks, self.rover)
+            for start in blocks[i:] + blocks[:i]:
+                if self.starts[start] >= size:
+                    return start
+        return None
+
+    def insert(self, start: int, size: int):
+        self.starts[start] = size
+        self.ends[start + size] = start
+        insort(self.classes[size_class(size)], start)
+        if self.largest is not None and size > self.largest:
+            self.largest = size
+
+    def remove(self, start: int) -> int:
+        size = self.starts.pop(start)
+        del self.ends[start + size]
+        blocks = self.classes[size_class(size)]
+        del blocks[bisect_left(blocks, start)]
+        if size == self.largest:
+            self.largest = None
+        return size
+
+
+class BumpAllocator:
+    def __init__(self, size: int):
+        self.size = size
+        self.clear()
+
+    def clear(self):
+        self.rebuild([(0, self.size)])
+
+    # only the last free range is bumped into, anything in front of it stays
+    # unused until a collection hands the space back
+    def rebuild(self, free_ranges: List[Tuple[int, int]]):
+        start, size = free_ranges[-1] if free_ranges else (self.size, 0)
+        self.top: int = start
+        self.limit: int = start + size
+
+    @property
+    def free_words(self) -> int:
+        return self.limit - self.top
+
+    @property
+    def free_runs(self) -> int:
+        return 1 if self.limit > self.top else 0
+
+    def shrink_limit(self) -> int:
+        return self.top if self.limit == self.size else self.size
+
+    # the bump region only follows the end of the heap when it already
+    # reached it
+    def resize(self, size: int):
+        if self.limit == self.size:
+            self.limit = size
+        self.size = size
+
+    @property
+    def largest_free_block(self) -> int:
+        return self.limit - self.top
+
+    def histogram(self) -> List[int]:
+        counts = [0] * NUM_SIZE_CLASSES
+        if self.limit > self.top:
+            counts[size_class(self.limit - self.top)] = 1
+        return counts
+
+    def alloc(self, size: int) -> int:
+        if self.top + size > self.limit:
+            return None
+
+        start = self.top
+        self.top += size
+        return start
+
+    def free(self, start: int, size: int):
+        # only the most recent allocation can be undone, the rest is reclaimed
+        # by the next collection resetting the cursors
+        if start + size == self.top:
+            self.top = start
+
+
+# Immix style: the heap is split into blocks of lines and whole free lines
+# are handed out as holes to bump allocate into, partly used blocks first and
+# then free blocks. an object that doesn't fit what is left of the current
+# hole goes to the next hole if it fits in a line, or else to a separate
+# overflow block so a medium sized object can't throw away a hole that is
+# only a bit too small for it. objects bigger than a block get a run of free
+# blocks to themselves. what is left of a hole once it is given up is lost
+# until the next collection hands it back
+class LineAllocator:
+    def __init__(self, size: int, line_size: int = LINE_SIZE, block_size: int = BLOCK_SIZE):
+        if block_size % line_size != 0:
+            raise ValueError('block size needs to be a multiple of the line size: {}, but was {}'.format(line_size, block_size))
+
+        self.size = size
+        self.line_size = line_size
+        self.block_size = block_size
+        self.clear()
+
+    def clear(self):
+        self.rebuild([(0, self.size)])
+
+    def rebuild(self, free_ranges: List[Tuple[int, int]]):
+        # (start, end) of the holes in partly used blocks in address order,
+        # the ones before `next_hole` have been used up
+        self.holes: List[Tuple[int, int]] = []
+        self.next_hole: int = 0
+        self.free_blocks: List[int] = [] # sorted starts of completely free blocks
+        self.cursor: int = 0
+        self.limit: int = 0
+        self.overflow: int = 0
+        self.overflow_limit: int = 0
+        self.free_words: int = 0
+        self.largest: int = None
+        for start, size in free_ranges:
+            self.free(start, size)
+
+    @property
+    def free_runs(self) -> int:
+        return len(self.runs())
+
+    @property
+    def largest_free_block(self) -> int:
+        if self.largest is None:
+            self.largest = max((end - start for start, end in self.runs()), default = 0)
+        return self.largest
+
+    def histogram(self) -> List[int]:
+        counts = [0] * NUM_SIZE_CLASSES
+        for start, end in self.runs():
+            counts[size_class(end - start)] += 1
+        return counts
+
+    # every stretch of free words, neighbouring holes and blocks merged
+    def runs(self) -> List[Tuple[int, int]]:
+        pieces = self.holes[self.next_hole:] + [(block, block + self.block_size) for block in self.free_blocks]
+        pieces += [(self.cursor, self.limit), (self.overflow, self.overflow_limit)]
+        runs: List[Tuple[int, int]] = []
+        for start, end in sorted(piece for piece in pieces if piece[1] > piece[0]):
+            if runs and runs[-1][1] == start:
+                runs[-1] = (runs[-1][0], end)
+            else:
+                runs.append((start, end))
+        return runs
+
+    # free blocks and holes running up to the end of the heap can be given up
+    def shrink_limit(self) -> int:
+        blocks = set(self.free_blocks)
+        hole_starts = {end: start for start, end in self.holes[self.next_hole:]}
+        limit = self.size
+        while True:
+            if limit in hole_starts:
+                limit = hole_starts[limit]
+            elif limit % self.block_size == 0 and limit - self.block_size in blocks:
+                limit -= self.block_size
+            else:
+                return limit
+
+    def resize(self, size: int):
+        if size > self.size:
+            old_size = self.size
+            self.size = size
+            self.free(old_size, size - old_size)
+        elif size < self.size:
+            self.size = size
+            for start, end in self.holes[self.next_hole:]:
+                if end > size:
+                    self.free_words -= end - max(start, size)
+            self.holes = [(start, min(end, size)) for start, end in self.holes[self.next_hole:] if start < size]
+            self.next_hole = 0
+            blocks = [block for block in self.free_blocks if block + self.block_size > size]
+            self.free_blocks = self.free_blocks[:len(self.free_blocks) - len(blocks)]
+            self.free_words -= self.block_size * len(blocks)
+            if blocks and blocks[0] < size:
+                self.free(blocks[0], size - blocks[0])
+            self.largest = None
+
+    def alloc(self, size: int) -> int:
+        if size > self.block_size:
+            return self.alloc_large(size)
+
+        start = self.cursor
+        if start + size > self.limit:
+            if size > self.line_size:
+                return self.alloc_overflow(size)
+            while True:
+                if not self.next_hole_or_block():
+                    return None
+                if self.cursor + size <= self.limit:
+                    break
+            start = self.cursor
+        self.cursor = start + size
+        self.free_words -= size
+        self.largest = None
+        return start
+
+    # whether alloc would find room for an object no bigger than a block,
+    # without taking it
+    def fits(self, size: int) -> bool:
+        if self.cursor + size <= self.limit or self.free_blocks:
+            return True
+        if size > self.line_size and self.overflow + size <= self.overflow_limit:
+            return True
+        holes = self.holes
+        return any(holes[i][1] - holes[i][0] >= size for i in range(self.next_hole, len(holes)))
+
+    # moves the cursor on to the next hole, or the next free block once the
+    # holes have run out, and gives up what was left of the current one
+    def next_hole_or_block(self) -> bool:
+        if self.next_hole < len(self.holes):
+            start, end = self.holes[self.next_hole]
+            self.next_hole += 1
+        elif self.free_blocks:
+            start = self.free_blocks.pop(0)
+            end = start + self.block_size
+        else:
+            return False
+        self.free_words -= self.limit - self.cursor
+        self.cursor, self.limit = start, end
+        return True
+
+    def alloc_overflow(self, size: int) -> int:
+        start = self.overflow
+        if start + size > self.overflow_limit:
+            if not self.free_blocks:
+                return self.alloc_fit(size)
+            self.free_words -= self.overflow_limit - self.overflow
+            start = self.free_blocks.pop(0)
+            self.overflow_limit = start + self.block_size
+        self.overflow = start + size
+        self.free_words -= size
+        self.largest = None
+        return start
+
+    # with no free block left for the overflow the first hole big enough is
+    # used, leaving the ones in front of it for smaller objects
+    def alloc_fit(self, size: int) -> int:
+        for i in range(self.next_hole, len(self.holes)):
+            start, end = self.holes[i]
+            if end - start >= size:
+                if end - start == size:
+                    del self.holes[i]
+                else:
+                    self.holes[i] = (start + size, end)
+                self.free_words -= size
+                self.largest = None
+                return start
+        return None
+
+    def alloc_large(self, size: int) -> int:
+        blocks = -(-size // self.block_size)
+        free_blocks = self.free_blocks
+        for i in range(len(free_blocks) - blocks + 1):
+            start = free_blocks[i]
+            if free_blocks[i + blocks - 1] == start + (blocks - 1) * self.block_size:
+                del free_blocks[i:i + blocks]
+                self.free_words -= blocks * self.block_size
+                self.largest = None
+                # the rest of the last block is usable straight away
+                self.free(start + size, blocks * self.block_size - size)
+                return start
+        return None
+
+    # only whole lines are handed out, and a range is split up at block
+    # boundaries into free blocks and holes
+    def free(self, start: int, size: int):
+        end = start + size
+        start = -(-start // self.line_size) * self.line_size
+        if end < self.size:
+            end -= end % self.line_size
+        while start < end:
+            block_end = min(start - start % self.block_size + self.block_size, self.size)
+            piece_end = min(end, block_end)
+            if start % self.block_size == 0 and piece_end - start == self.block_size:
+                insort(self.free_blocks, start)
+            else:
+                insort(self.holes, (start, piece_end), lo = self.next_hole)
+            self.free_words += piece_end - start
+            start = piece_end
+        self.largest = None
+
+
 class Heap:
-    def __init__(self, size: int, alignment: int):
+    def __init__(self, size: int, alignment: int, policy: str = FIRST_FIT, base: int = 0):
         if size % alignment != 0:
             msg = 'Heap size needs to be a multiple of given alignment: {}, but was {}'.format(alignment, size)
             raise ValueError(msg)
 
         self.size = size
-        self.contents = [None for _ in range(size)]
-        self.objs = {} # obj id to obj
+        self.alignment = alignment
+        # address of the first word, so that several heaps can share one
+        # address space. only References carry it, everything indexed by
+        # position in `contents` starts from 0
+        self.base = base
+        if policy == BUMP:
+            self.allocator = BumpAllocator(size)
+        elif policy == LINES:
+            self.allocator = LineAllocator(size)
+        else:
+            self.allocator = FreeListAllocator(size, policy)
+        self.clear()
         self.visualizer = HeapVisualizer(self)
 
+    # how the heap is shaped, all kept up to date as objects come and go
+    # rather than worked out by scanning it
+
+    @property
+    def free_words(self) -> int:
+        return self.allocator.free_words
+
+    @property
+    def largest_free_block(self) -> int:
+        return self.allocator.largest_free_block
+
+    @property
+    def free_runs(self) -> int:
+        return self.allocator.free_runs
+
+    # free blocks per size class, class k holding sizes in [2^k, 2^(k+1))
+    def free_histogram(self) -> List[int]:
+        return self.allocator.histogram()
+
+    # 1 - largest free block / free words, 0 when all free memory is in one block
+    def fragmentation(self) -> float:
+        free_words = self.allocator.free_words
+        return 1 - self.allocator.largest_free_block / free_words if free_words else 0.0
+
+    def shape(self) -> Dict:
+        return {
+            'live_words': self.live_words,
+            'free_words': self.free_words,
+            'largest_free_block': self.largest_free_block,
+            'free_runs': self.free_runs,
+            'free_histogram': self.free_histogram(),
+            'fragmentation': self.fragmentation(),
+        }
+
+    # grows the heap, or shrinks it as far as the free space at its end
+    # allows, and returns the size it ended up with
+    def resize(self, size: int) -> int:
+        size = -(-size // self.alignment) * self.alignment
+        if size < self.size:
+            size = max(size, -(-self.allocator.shrink_limit() // self.alignment) * self.alignment)
+        if size == self.size:
+            return size
+
+        if events.level >= events.INFO:
+            events.emit(events.INFO, events.GC, 'resizing heap from {} to {} words', self.size, size)
+        if size > self.size:
+            self.contents.extend(array('q', bytes(8 * (size - self.size))))
+            self.starts.extend(bytes(size - self.size))
+        else:
+            del self.contents[size:]
+            del self.starts[size:]
+        self.allocator.resize(size)
+        self.size = size
+        return size
+
+    def contains(self, ref: Reference) -> bool:
+        return self.base <= ref.address < self.base + self.size
+
     def load(self, ref: Reference) -> Object:
-        obj_id = self.contents[ref.address]
-        return self.objs[obj_id]
+        handle = self.contents[ref.address - self.base]
+        return self.objs[handle]
     
     def store(self, ref: Reference, obj: Object):
         if ref.size != obj.size():
             print('Trying to store object of size: {} in a reference slot of size: {}'.format(obj.size(), ref.size))
             sys.exit(1)
 
-        for i in range(ref.address, ref.address + ref.size):
-            self.contents[i] = obj.id
-        
-        self.objs[obj.id] = obj
+        handle = self.handles.get(obj.id)
+        if handle is None:
+            handle = self.next_handle
+            self.next_handle += 1
+            self.handles[obj.id] = handle
+            self.live_words += ref.size
+
+        address = ref.address - self.base
+        self.contents[address:address + ref.size] = array('q', [handle]) * ref.size
+        self.starts[address] = 1
+        self.objs[handle] = obj
 
     def alloc(self, size: int) -> Reference:
-        print('trying to allocate a chunk of size: {}'.format(size))
-
-        # need to find the first range of `size` that is all `None`s
-        in_a_row = 0
-        for n, content in enumerate(self.contents):
-            if content is None:
-                in_a_row += 1
-
-                if in_a_row == size:
-                    starting_address = n - size + 1
-                    print('found a valid chunk to allocate starting at address: {}'.format(starting_address))
-                    for i in range(starting_address, starting_address + size):
-                        self.contents[i] = "__ALLOCATED_BUT_EMPTY__"
-                    return Reference(starting_address, size)
-            else:
-                in_a_row = 0
+        starting_address = self.allocator.alloc(size)
+        if starting_address is None:
+            if events.level >= events.DEBUG:
+                events.emit(events.DEBUG, events.ALLOC, 'no chunk of size {} available', size)
+            return None
 
-        return None
+        if events.level >= events.DEBUG:
+            events.emit(events.DEBUG, events.ALLOC, 'allocated a chunk of size {} at address {}', size, self.base + starting_address)
+        self.contents[starting_address:starting_address + size] = array('q', [ALLOCATED]) * size
+        return Reference(self.base + starting_address, size)
 
     def free(self, ref: Reference):
-        obj_id = self.contents[ref.address]
-        del self.objs[obj_id]
+        if events.level >= events.DEBUG:
+            events.emit(events.DEBUG, events.FREE, 'freeing a chunk of size {} at address {}', ref.size, ref.address)
+        self.release(ref.address - self.base)
+        self.free_range(ref.address - self.base, ref.size)
+
+    # forgets the object starting at `address` without touching its cells, for
+    # collectors that reclaim or overwrite the memory themselves
+    def release(self, address: int) -> Object:
+        obj = self.objs.pop(self.contents[address])
+        del self.handles[obj.id]
+        self.starts[address] = 0
+        self.live_words -= len(obj.slots) + 1
+        return obj
+
+    # hands a range of cells back to the allocator without touching `objs`,
+    # for collectors that have already released the objects living there
+    def free_range(self, address: int, size: int):
+        self.wipe(address, size)
+        self.allocator.free(address, size)
+
+    def wipe(self, address: int, size: int):
+        self.contents[address:address + size] = array('q', bytes(8 * size))
+        self.starts[address:address + size] = bytes(size)
+
+    # slides the object at `src` over to `dst`, the cells it leaves behind are
+    # stale until something else is stored or wiped there
+    def move(self, src: Reference, dst: Reference):
+        src_address = src.address - self.base
+        dst_address = dst.address - self.base
+        self.starts[src_address] = 0
+        self.contents[dst_address:dst_address + dst.size] = self.contents[src_address:src_address + src.size]
+        self.starts[dst_address] = 1
+
+    # copies `size` cells from `src` down to `dst` in one go, for compactors
+    # sliding a run of neighbouring objects at once. `starts` is left to `reindex`
+    def slide(self, src: int, dst: int, size: int):
+        self.contents[dst:dst + size] = self.contents[src:src + size]
 
-        for i in range(ref.address, ref.address + ref.size):
-            self.contents[i] = None
+    # replaces the object index once a compactor has slid every survivor into
+    # place. `live` holds the new address and the handle of each survivor,
+    # everything else is forgotten
+    def reindex(self, live: List[Tuple[int, int]]):
+        objs = self.objs
+        self.objs = {handle: objs[handle] for _, handle in live}
+        self.handles = {obj.id: handle for handle, obj in self.objs.items()}
+        self.live_words = sum(len(obj.slots) + 1 for obj in self.objs.values())
+        self.starts = bytearray(self.size)
+        for address, _ in live:
+            self.starts[address] = 1
+
+    # a 1 at every object start in [start, end) whose byte in `marks` is 0,
+    # indexed from `start`. worked out with whole-bitmap integer ops instead of
+    # a loop over the heap
+    def unmarked_starts(self, marks: bytearray, start: int = 0, end: int = None) -> bytes:
+        end = self.size if end is None else min(end, self.size)
+        starts = int.from_bytes(self.starts[start:end], 'little')
+        marked = int.from_bytes(marks[start:end], 'little')
+        return (starts & ~marked).to_bytes(end - start, 'little')
 
     def clear(self):
-        self.contents = [None for _ in range(self.size)]
-        self.objs = {} # obj id to obj
+        self.contents = array('q', bytes(8 * self.size)) # handle per word, FREE if unused
+        self.starts = bytearray(self.size)               # 1 where an object begins
+        self.objs: Dict[int, Object] = {}                # handle to obj
+        self.handles: Dict[str, int] = {}                # obj id to handle
+        self.live_words = 0                              # words held by objects in `objs`
+        self.next_handle = 1
+        self.allocator.clear()
 
     def visualize(self):
         self.visualizer.visualize()
@@ -70,44 +628,79 @@ class HeapVisualizerCell:
         self.cell_middle = '| {} |'.format(cell_id)
 
 
+# draws the heap as one box per run of identical cells, so an object or a
+# free block is a single box whatever its size. the heap is drawn in regions
+# of `region_words` and a region is only drawn again once its cells have
+# changed. frames asked for within `min_interval` seconds of the last one
+# are skipped unless forced
 class HeapVisualizer:
-    def __init__(self, heap: Heap):
+    def __init__(self, heap: Heap, region_words: int = VISUALIZER_REGION, min_interval: float = 0.0):
         self.heap: Heap = heap
         terminal_size = shutil.get_terminal_size((80, 20))
         self.columns = terminal_size.columns
+        self.region_words = region_words
+        self.min_interval = min_interval
+        self.last_frame: float = None
+        # region start to a hash of the cells it was last drawn with
+        self.drawn: Dict[int, int] = {}
 
-    def visualize(self):
-        cells: [] = []
-        for item in self.heap.contents:
-            cell_id = item
-            if item is None:
-                cell_id = ' '
-
-            cells.append(HeapVisualizerCell(cell_id))
-
-        return self.megacell(cells)
-
-    def megacell(self, cells: List[HeapVisualizerCell]):
-        tops = map(lambda c: c.cell_top_bottom, cells)
-        middles = map(lambda c: c.cell_middle, cells)
-        bottoms = map(lambda c: c.cell_top_bottom, cells)
-        
-        megatop = reduce(lambda a, b: a + b, tops)
-        megamiddle = reduce(lambda a, b: a + b, middles)
-        megabottom = reduce(lambda a, b: a + b, bottoms)
-
-        split_tops    = list(divide_chunks(megatop,    self.columns))
-        split_middles = list(divide_chunks(megamiddle, self.columns))
-        split_bottoms = list(divide_chunks(megabottom, self.columns))
-
-        for i in range(0, len(split_tops)):
-            print(split_tops[i])
-            print(split_middles[i])
-            print(split_bottoms[i])
-
-def divide_chunks(l, n): 
-    # looping till length l 
-    for i in range(0, len(l), n):  
-        yield l[i:i + n] 
- 
+    def visualize(self, force: bool = False):
+        now = time.perf_counter()
+        if not force and self.last_frame is not None and now - self.last_frame < self.min_interval:
+            return
+        self.last_frame = now
+
+        unchanged = 0
+        regions = range(0, self.heap.size, self.region_words)
+        for start in regions:
+            end = min(start + self.region_words, self.heap.size)
+            cells = self.heap.contents[start:end].tobytes()
+            signature = hash(cells)
+            if self.drawn.get(start) == signature:
+                unchanged += 1
+                continue
+            self.drawn[start] = signature
+            if len(regions) > 1:
+                print('words {} to {}:'.format(start, end - 1))
+            self.draw([HeapVisualizerCell(self.label(handle, words)) for handle, words in self.spans(cells)])
+        if unchanged == 1 and len(regions) == 1:
+            print('unchanged since the last frame')
+        elif unchanged:
+            print('{} of {} regions unchanged since the last frame'.format(unchanged, len(regions)))
+
+    # (cell value, words) for every run of identical cells. the regex matches
+    # one 8 byte cell and then as many repeats of it as follow, every match
+    # is a whole number of cells so the next one starts on a cell too
+    @staticmethod
+    def spans(cells: bytes) -> Iterator[Tuple[int, int]]:
+        for run in CELL_RUN.finditer(cells):
+            yield int.from_bytes(run.group(1), sys.byteorder, signed = True), len(run.group(0)) // 8
+
+    def label(self, handle: int, words: int) -> str:
+        if handle == FREE:
+            cell_id = ' '
+        elif handle == ALLOCATED:
+            cell_id = '__ALLOCATED_BUT_EMPTY__'
+        else:
+            cell_id = self.heap.objs[handle].id
+        return cell_id if words == 1 else '{} x{}'.format(cell_id, words)
+
+    # boxes are wrapped onto a new row instead of being cut at the edge of
+    # the terminal
+    def draw(self, cells: List[HeapVisualizerCell]):
+        row: List[HeapVisualizerCell] = []
+        width = 0
+        for cell in cells:
+            if row and width + len(cell.cell_top_bottom) > self.columns:
+                self.draw_row(row)
+                row, width = [], 0
+            row.append(cell)
+            width += len(cell.cell_top_bottom)
+        if row:
+            self.draw_row(row)
 
+    def draw_row(self, row: List[HeapVisualizerCell]):
+        top = ''.join(cell.cell_top_bottom for cell in row)
+        print(top)
+        print(''.join(cell.cell_middle for cell in row))
+        print(top)
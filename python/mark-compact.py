@@ -1,34 +1,108 @@
-from typing import List
+from typing import Dict, Iterator, List, Tuple
 import sys
+import time
+import tracemalloc
+from array import array
+import events
+import parallel
+from metrics import Metrics
+from policy import Policy
 from object import Object, Reference
-from heap import Heap
+from heap import Heap, BUMP, FIRST_FIT, ALLOCATED
+from itertools import accumulate
+
+LISP2 = 'lisp-2'
+COMPRESSOR = 'compressor'
+THREADED = 'threaded'
+COMPACTION_MODES = (LISP2, COMPRESSOR, THREADED)
+
+# words covered by each entry of the compressor's offset table
+OFFSET_BLOCK = 64
+
+# while threaded, a header cell or a reference holds -(location + 2), below
+# every handle and ALLOCATED. a location is a root index with the low bit
+# set, or a field index in the low `field_bits` above a clear low bit with the
+# owning object's handle above that
 
 class Collector:
-    def __init__(self, heap: Heap):
-        self.heap = heap
+    def __init__(self, heap: Heap, bitmap: bool = False, metrics: Metrics = None, mode: str = LISP2,
+                 workers: int = 1):
+        if mode not in COMPACTION_MODES:
+            raise ValueError('unknown compaction mode: {}, expected one of {}'.format(mode, COMPACTION_MODES))
 
-    def collect(self, roots: List[Reference]):
-        print('beginning collection')
-        self.mark_from_roots(roots)
-        self.compact(roots)
-        print('collection complete. heap is now: {}'.format(self.heap.contents))
+        self.heap = heap
+        self.mode = mode
+        # processes marking is spread over, see parallel.py
+        self.workers = workers
+        # one mark byte per heap word, set at the object's first word. when
+        # absent the mark lives on the object itself. the compressor, threading
+        # and parallel marking need it, headers are not readable while threaded
+        self.marks: bytearray = bytearray(heap.size) if bitmap or mode != LISP2 or parallel.available(workers) else None
+        # compressor only: a 1 for every word of every marked object
+        self.live: bytearray = bytearray(heap.size) if mode == COMPRESSOR else None
+        # compressor only: live words in front of each OFFSET_BLOCK
+        self.offsets: List[int] = []
+        self.metrics: Metrics = metrics if metrics is not None else Metrics()
+        # where the object starting at each address goes, only the entries of
+        # the current survivors mean anything
+        self.forwarding = array('q')
+        # threading only: bits a location keeps for the field index, enough
+        # for every field of the biggest object in the heap
+        self.field_bits = 0
+        self.freed = 0
+
+    # sweeps instead of compacting when `compact` is false, which only makes
+    # sense on a heap that allocates from a free list
+    def collect(self, roots: List[Reference], compact: bool = True):
+        with self.metrics.pause:
+            events.emit(events.INFO, events.GC, 'beginning collection')
+            if self.marks is not None:
+                self.marks = bytearray(self.heap.size)
+            if self.live is not None:
+                self.live = bytearray(self.heap.size)
+            self.mark_from_roots(roots)
+            if not compact:
+                self.sweep()
+            elif self.mode == COMPRESSOR:
+                self.compress(roots)
+            elif self.mode == THREADED:
+                self.thread_compact(roots)
+            else:
+                self.compact(roots)
+            self.metrics.count('collections')
+            events.emit(events.INFO, events.GC, 'collection complete, {} words free', self.heap.allocator.free_words)
 
     def mark_from_roots(self, roots: List[Reference]):
-        print('marking roots')
+        events.emit(events.INFO, events.MARK, 'marking roots')
         worklist: List[Reference] = []
-        for ref in roots:
-            obj = self.heap.load(ref)
-            print('checking root: {}'.format(obj.id))
-            if obj != None and not obj.is_marked():
-                obj.mark()
-                worklist.append(ref)
+        with self.metrics.phase('mark_roots'):
+            for ref in roots:
+                obj = self.heap.load(ref)
+                if obj != None and not self.is_marked(ref, obj):
+                    if events.level >= events.DEBUG:
+                        events.emit(events.DEBUG, events.MARK, 'marking root {}', obj.id)
+                    self.set_mark(ref, obj)
+                    worklist.append(ref)
+        with self.metrics.phase('mark'):
+            if parallel.available(self.workers):
+                self.mark_parallel(worklist)
+            else:
                 self.mark(worklist)
 
+    def mark_parallel(self, worklist: List[Reference]):
+        events.emit(events.INFO, events.MARK, 'marking with {} workers', self.workers)
+        objects, words = parallel.mark(self.heap, self.marks, [ref.address for ref in worklist], self.workers, self.live)
+        self.metrics.count('objects_visited', objects)
+        self.metrics.count('words_visited', words)
+
     def mark(self, worklist: List[Reference]):
-        print('marking the worklist')
+        objects = 0
+        words = 0
         while worklist:
             ref = worklist.pop()
             obj = self.heap.load(ref)
+            objects += 1
+            words += obj.size()
             for f_name, f_ref in obj.fields.items():
                 if f_ref is None:
                     continue
@@ -38,95 +112,351 @@ class Collector:
                     print('ACTIVE REFERENCE LEADING TO DEAD MEMORY. THIS SHOULD BE IMPOSSIBLE')
                     sys.exit(1)
 
-                if not child_obj.is_marked():
-                    child_obj.mark()
+                if not self.is_marked(f_ref, child_obj):
+                    if events.level >= events.DEBUG:
+                        events.emit(events.DEBUG, events.MARK, 'marking {} through {}.{}', child_obj.id, obj.id, f_name)
+                    self.set_mark(f_ref, child_obj)
                     worklist.append(f_ref)
-
+        self.metrics.count('objects_visited', objects)
+        self.metrics.count('words_visited', words)
+
+    def is_marked(self, ref: Reference, obj: Object) -> bool:
+        if self.marks is not None:
+            return self.marks[ref.address] == 1
+        return obj.is_marked()
+
+    def set_mark(self, ref: Reference, obj: Object):
+        if self.marks is not None:
+            self.marks[ref.address] = 1
+            if self.live is not None:
+                self.live[ref.address:ref.address + ref.size] = b'\x01' * ref.size
+        else:
+            obj.mark()
+
+    # frees the dead where they lie and leaves the survivors where they are
+    def sweep(self):
+        events.emit(events.INFO, events.SWEEP, 'sweeping instead of compacting')
+        heap = self.heap
+        starts = heap.starts
+        freed = freed_words = 0
+        with self.metrics.phase('sweep'):
+            curr_ptr = starts.find(1)
+            while curr_ptr != -1:
+                obj = heap.objs[heap.contents[curr_ptr]]
+                size = len(obj.slots) + 1
+                if self.marks is not None:
+                    marked = self.marks[curr_ptr]
+                else:
+                    marked = obj.is_marked()
+                    obj.unmark()
+                if not marked:
+                    heap.release(curr_ptr)
+                    heap.free_range(curr_ptr, size)
+                    freed += 1
+                    freed_words += size
+                curr_ptr = starts.find(1, curr_ptr + size)
+        self.metrics.count('objects_freed', freed)
+        self.metrics.count('words_freed', freed_words)
+        self.metrics.count('sweeps')
+
+    # Lisp-2 with the three passes cut down to one scan of the heap: that scan
+    # lists the survivors and fills an address indexed forwarding table, the
+    # other two only walk the list. fields are redirected in place and runs
+    # of neighbouring survivors slide down as a single slice
     def compact(self, roots: List[Reference]):
-        print('beginning compaction')
-        self.compute_locations(0, len(self.heap.contents), 0)
-        self.update_references(roots, 0, len(self.heap.contents))
-        self.relocate(0, len(self.heap.contents))
-        print('compaction finished')
-
-    def compute_locations(self, start: int, end: int, to: int):
-        curr_ptr = start
+        events.emit(events.INFO, events.GC, 'beginning compaction')
+        used = self.heap.size - self.heap.allocator.free_words
+        with self.metrics.phase('compute_locations'):
+            live, free = self.compute_locations(0, len(self.heap.contents), 0)
+        with self.metrics.phase('update_references'):
+            self.update_references(roots, live)
+        with self.metrics.phase('relocate'):
+            self.relocate(live)
+
+        # everything live now sits below `free`, so what is left is one block
+        self.heap.wipe(free, len(self.heap.contents) - free)
+        self.heap.allocator.rebuild([(free, len(self.heap.contents) - free)])
+        self.metrics.count('objects_freed', self.freed)
+        self.metrics.count('words_freed', used - free)
+        events.emit(events.INFO, events.GC, 'compaction finished')
+
+    # returns the (address, handle, obj) of every survivor in address order
+    # along with the end of where they will be packed
+    def compute_locations(self, start: int, end: int, to: int) -> Tuple[List[Tuple[int, int, Object]], int]:
+        if len(self.forwarding) != len(self.heap.contents):
+            self.forwarding = array('q', bytes(8 * len(self.heap.contents)))
+        forwarding = self.forwarding
+        contents = self.heap.contents
+        bitmap = self.marks is not None
+        live: List[Tuple[int, int, Object]] = []
         free = to
-        while curr_ptr < end:
-            obj_id = self.heap.contents[curr_ptr]
-            if obj_id is None:
-                curr_ptr += 1
-                continue
-
-            obj = self.heap.objs[obj_id]
-            if obj.is_marked():
-                obj.forwarding_address = free
-                free += obj.size()
-            curr_ptr += obj.size()
+        for curr_ptr, obj in self.marked_objects(start, end):
+            forwarding[curr_ptr] = free
+            live.append((curr_ptr, contents[curr_ptr], obj))
+            free += len(obj.slots) + 1
+            if not bitmap:
+                obj.unmark()
+        self.freed = len(self.heap.objs) - len(live)
+        return live, free
 
-    def update_references(self, roots: List[Reference], start: int, end: int):
+    # only survivors are looked at, and only survivors can be pointed at by
+    # them, so every entry read from the table was written by this collection
+    def update_references(self, roots: List[Reference], live: List[Tuple[int, int, Object]]):
+        forwarding = self.forwarding
         for root in roots:
-            obj = self.heap.load(root)
-            for f_name, f_ref in obj.fields.items():
-                child_obj = self.heap.load(f_ref)
-                new_ref = Reference(child_obj.forwarding_address, obj.size())
-                obj.fields[f_name] = new_ref
-
-        curr_ptr = start
-        while curr_ptr < end:
-            obj_id = self.heap.contents[curr_ptr]
-            if obj_id is None:
-                curr_ptr += 1
+            root.address = forwarding[root.address]
+
+        for _, _, obj in live:
+            for f_ref in obj.slots:
+                if f_ref is not None:
+                    f_ref.address = forwarding[f_ref.address]
+
+    def relocate(self, live: List[Tuple[int, int, Object]]):
+        forwarding = self.forwarding
+        moved = moved_words = 0
+        # [run_src, run_end) slides down to run_dst
+        run_src = run_end = run_dst = 0
+        for curr_ptr, _, obj in live:
+            size = len(obj.slots) + 1
+            dst = forwarding[curr_ptr]
+            if dst != curr_ptr:
+                moved += 1
+                moved_words += size
+            if curr_ptr == run_end and dst - curr_ptr == run_dst - run_src:
+                run_end += size
                 continue
-
-            obj = self.heap.objs[obj_id]
-            if obj.is_marked():
-                for f_name, f_ref in obj.fields.items():
-                    child_obj = self.heap.load(f_ref)
-                    new_ref = Reference(child_obj.forwarding_address, obj.size())
-                    obj.fields[f_name] = new_ref
-            curr_ptr += obj.size()
-
-    def relocate(self, start: int, end: int):
-        curr_ptr = start
-        while curr_ptr < end:
-            obj_id = self.heap.contents[curr_ptr]
-            if obj_id is None:
-                curr_ptr += 1
+            if run_dst != run_src:
+                self.heap.slide(run_src, run_dst, run_end - run_src)
+            run_src, run_end, run_dst = curr_ptr, curr_ptr + size, dst
+        if run_dst != run_src:
+            self.heap.slide(run_src, run_dst, run_end - run_src)
+
+        self.heap.reindex([(forwarding[curr_ptr], handle) for curr_ptr, handle, _ in live])
+        self.metrics.count('objects_moved', moved)
+        self.metrics.count('words_moved', moved_words)
+
+    # Compressor style: an object's new address is the number of live words in
+    # front of it, read off the offset table and the live bitmap, so nothing
+    # has to walk the heap to work out forwarding addresses. references are
+    # updated and objects slid in the same pass over the survivors
+    def compress(self, roots: List[Reference]):
+        events.emit(events.INFO, events.GC, 'beginning compaction')
+        used = self.heap.size - self.heap.allocator.free_words
+        with self.metrics.phase('compute_offsets'):
+            self.compute_offsets()
+        with self.metrics.phase('update_references'):
+            for root in roots:
+                root.address = self.forward(root.address)
+        with self.metrics.phase('relocate'):
+            free = self.update_and_relocate()
+
+        self.heap.wipe(free, len(self.heap.contents) - free)
+        self.heap.allocator.rebuild([(free, len(self.heap.contents) - free)])
+        self.metrics.count('objects_freed', self.freed)
+        self.metrics.count('words_freed', used - free)
+        events.emit(events.INFO, events.GC, 'compaction finished')
+
+    # live words per block counted by bytearray.count and summed up front to
+    # back, both done in C rather than by stepping over words
+    def compute_offsets(self):
+        live = self.live
+        counts = [live.count(1, block, block + OFFSET_BLOCK) for block in range(0, len(live), OFFSET_BLOCK)]
+        self.offsets = list(accumulate(counts, initial = 0))
+
+    def forward(self, address: int) -> int:
+        block = address // OFFSET_BLOCK
+        return self.offsets[block] + self.live.count(1, block * OFFSET_BLOCK, address)
+
+    # objects are visited in address order and only ever slide down, so an
+    # object's cells are read before anything is moved over them. forwarding
+    # addresses come from the bitmaps, never from the cells being overwritten
+    def update_and_relocate(self) -> int:
+        heap = self.heap
+        forward = self.forward
+        moved = moved_words = 0
+        survivors: List[Tuple[int, int]] = []
+        # [run_src, run_end) slides down to run_dst
+        run_src = run_end = run_dst = 0
+        for curr_ptr, obj in self.marked_objects(0, len(heap.contents)):
+            for f_ref in obj.slots:
+                if f_ref is not None:
+                    f_ref.address = forward(f_ref.address)
+            size = len(obj.slots) + 1
+            dst = forward(curr_ptr)
+            survivors.append((dst, heap.contents[curr_ptr]))
+            if dst != curr_ptr:
+                moved += 1
+                moved_words += size
+            if curr_ptr == run_end and dst - curr_ptr == run_dst - run_src:
+                run_end += size
                 continue
-
-            obj = self.heap.objs[obj_id]
-            if obj.is_marked():
-                new_ref = Reference(obj.forwarding_address, obj.size())
-                self.heap.store(new_ref, obj)
-                obj.unmark()
+            if run_dst != run_src:
+                heap.slide(run_src, run_dst, run_end - run_src)
+            run_src, run_end, run_dst = curr_ptr, curr_ptr + size, dst
+        if run_dst != run_src:
+            heap.slide(run_src, run_dst, run_end - run_src)
+
+        self.freed = len(heap.objs) - len(survivors)
+        heap.reindex(survivors)
+        self.metrics.count('objects_moved', moved)
+        self.metrics.count('words_moved', moved_words)
+        return self.offsets[-1]
+
+    # Jonkers: every reference to an object is threaded onto a chain that
+    # starts at the object's header cell and ends with the handle the header
+    # held, so new addresses are handed out by walking chains and are never
+    # stored anywhere. the first pass resolves references that point
+    # forwards, the second those that point backwards and slides objects
+    def thread_compact(self, roots: List[Reference]):
+        events.emit(events.INFO, events.GC, 'beginning compaction')
+        heap = self.heap
+        marks = self.marks
+        used = heap.size - heap.allocator.free_words
+        roots = list(roots)
+        field_bits = self.field_bits = max((len(obj.slots) for obj in heap.objs.values()), default = 0).bit_length()
+        with self.metrics.phase('update_forward_references'):
+            for i, root in enumerate(roots):
+                self.thread(root, i << 1 | 1)
+            free = 0
+            curr_ptr = marks.find(1)
+            while curr_ptr != -1:
+                handle = self.unthread(curr_ptr, free, roots)
+                obj = heap.objs[handle]
+                for i, f_ref in enumerate(obj.slots):
+                    if f_ref is not None:
+                        self.thread(f_ref, (handle << field_bits | i) << 1)
+                size = len(obj.slots) + 1
+                free += size
+                curr_ptr = marks.find(1, curr_ptr + size)
+
+        with self.metrics.phase('relocate'):
+            moved = moved_words = 0
+            survivors: List[Tuple[int, int]] = []
+            free = 0
+            # [run_src, run_end) slides down to run_dst
+            run_src = run_end = run_dst = 0
+            curr_ptr = marks.find(1)
+            while curr_ptr != -1:
+                handle = self.unthread(curr_ptr, free, roots)
+                size = len(heap.objs[handle].slots) + 1
+                survivors.append((free, handle))
+                if free != curr_ptr:
+                    moved += 1
+                    moved_words += size
+                if curr_ptr != run_end or free - curr_ptr != run_dst - run_src:
+                    if run_dst != run_src:
+                        heap.slide(run_src, run_dst, run_end - run_src)
+                    run_src, run_end, run_dst = curr_ptr, curr_ptr, free
+                run_end += size
+                free += size
+                curr_ptr = marks.find(1, curr_ptr + size)
+            if run_dst != run_src:
+                heap.slide(run_src, run_dst, run_end - run_src)
+
+        self.freed = len(heap.objs) - len(survivors)
+        heap.reindex(survivors)
+        heap.wipe(free, len(heap.contents) - free)
+        heap.allocator.rebuild([(free, len(heap.contents) - free)])
+        self.metrics.count('objects_moved', moved)
+        self.metrics.count('words_moved', moved_words)
+        self.metrics.count('objects_freed', self.freed)
+        self.metrics.count('words_freed', used - free)
+        events.emit(events.INFO, events.GC, 'compaction finished')
+
+    # hangs `ref`, found at `location`, onto the chain of the object it points at
+    def thread(self, ref: Reference, location: int):
+        contents = self.heap.contents
+        target = ref.address
+        ref.address = contents[target]
+        contents[target] = -(location + 2)
+
+    # points everything on the chain at `address` to `to` and puts the
+    # object's handle back in its header, which is returned
+    def unthread(self, address: int, to: int, roots: List[Reference]) -> int:
+        objs = self.heap.objs
+        field_bits = self.field_bits
+        field_mask = (1 << field_bits) - 1
+        value = self.heap.contents[address]
+        while value < ALLOCATED:
+            location = -value - 2
+            if location & 1:
+                ref = roots[location >> 1]
             else:
-                for i in range(curr_ptr, curr_ptr + obj.size()):
-                    self.heap.contents[i] = None
-                del self.heap.objs[obj.id]
-            curr_ptr += obj.size()
+                ref = objs[location >> (field_bits + 1)].slots[location >> 1 & field_mask]
+            value = ref.address
+            ref.address = to
+        self.heap.contents[address] = value
+        return value
+
+    # walks the marked objects in address order, jumping straight from one
+    # mark, or without a bitmap from one object start, to the next
+    def marked_objects(self, start: int, end: int) -> Iterator[Tuple[int, Object]]:
+        if self.marks is not None:
+            curr_ptr = self.marks.find(1, start, end)
+            while curr_ptr != -1:
+                obj = self.heap.objs[self.heap.contents[curr_ptr]]
+                yield curr_ptr, obj
+                curr_ptr = self.marks.find(1, curr_ptr + obj.size(), end)
+            return
+
+        starts = self.heap.starts
+        curr_ptr = starts.find(1, start, end)
+        while curr_ptr != -1:
+            obj = self.heap.objs[self.heap.contents[curr_ptr]]
+            if obj.is_marked():
+                yield curr_ptr, obj
+            curr_ptr = starts.find(1, curr_ptr + obj.size(), end)
 
 class Runtime:
-    def __init__(self, heap_size: int, heap_alignment: int):
+    def __init__(self, heap_size: int, heap_alignment: int, bitmap: bool = False, mode: str = LISP2, workers: int = 1,
+                 policy: Policy = None):
         self.roots: Dict[str, Reference] = {}
-        self.heap = Heap(size = heap_size, alignment = heap_alignment)
-        self.collector = Collector(self.heap)
+        self.policy: Policy = policy if policy is not None else Policy()
+        # the holes a sweep leaves are only of use to a free list
+        allocation = FIRST_FIT if self.policy.adaptive_compaction else BUMP
+        self.heap = Heap(size = heap_size, alignment = heap_alignment, policy = allocation)
+        self.metrics = Metrics()
+        self.collector = Collector(self.heap, bitmap, self.metrics, mode, workers)
 
     # Mutator methods
     def new(self, obj: Object) -> Reference:
-        print("attempting to allocate new object of size {}, with id: {}".format(obj.size(), obj.id))
+        if events.level >= events.DEBUG:
+            events.emit(events.DEBUG, events.ALLOC, 'attempting to allocate new object of size {}, with id: {}', obj.size(), obj.id)
 
-        ref = self.heap.alloc(obj.size())
+        size = obj.size()
+        if self.policy.should_collect(self.heap, size):
+            self.collect_for(size)
+        ref = self.heap.alloc(size)
 
         if ref == None:
-            self.collector.collect(self.roots.values())
-            ref = self.heap.alloc(obj.size())
+            compacted = self.collect_for(size)
+            ref = self.heap.alloc(size)
+            # a sweep can leave enough free words without a block big enough
+            if ref == None and not compacted:
+                self.collect_for(size, compact = True)
+                ref = self.heap.alloc(size)
+            old_size = self.heap.size
+            if ref == None and self.heap.resize(self.policy.exhausted(self.heap, size)) > old_size:
+                ref = self.heap.alloc(size)
             if ref == None:
                 raise Exception("out of memory")
   
+        self.policy.allocated(size)
         self.write(ref, obj)
         self.roots[obj.id] = ref
         return ref
+
+    # a collection the runtime decided on, the policy picks between sweeping
+    # and compacting and gets to resize the heap afterwards. returns whether
+    # it compacted
+    def collect_for(self, size: int, compact: bool = None) -> bool:
+        if compact is None:
+            compact = self.policy.should_compact(self.heap)
+        started = time.perf_counter()
+        self.collector.collect(self.roots.values(), compact)
+        finished = time.perf_counter()
+        self.heap.resize(self.policy.collected(self.heap, self.heap.live_words, started, finished))
+        return compact
     
     def read(self, ref: Reference) -> Object:
         return self.heap.load(ref)
@@ -140,8 +470,20 @@ class Runtime:
         if field not in src_object.fields:
             raise ValueError('unknown field: {} on obj: {}'.format(field, self.id))
 
+        # fields get their own reference so that moving a root in place can't
+        # change what a field points at mid-compaction
+        if target is not None:
+            target = Reference(target.address, target.size)
         src_object.fields[field] = target
 
+    # the root gets its own reference, like a field does in set_field, so
+    # moving the root in place can't move a field that shared it
+    def add_root(self, ref: Reference):
+        self.roots[self.heap.load(ref).id] = Reference(ref.address, ref.size)
+
+    def stats(self) -> Dict:
+        return self.metrics.stats()
+
     def drop(self, obj_id: str):
         if obj_id in self.roots:
             del self.roots[obj_id]
@@ -150,17 +492,57 @@ class Runtime:
             sys.exit(1)
 
     def collect(self):
-        print('heap before collection: ')
-        self.heap.visualize()
+        if events.enabled(events.INFO):
+            print('heap before collection: ')
+            self.heap.visualize()
         self.collector.collect(self.roots.values())
-        print('heap after collection: ')
-        self.heap.visualize()
+        if events.enabled(events.INFO):
+            print('heap after collection: ')
+            self.heap.visualize()
 
 def main():
+    if sys.argv[1:] == ['compare-modes']:
+        return compare_modes()
+
+    events.configure(events.DEBUG)
     runtime = Runtime(heap_size = 100, heap_alignment = 1)
     build_object_graph(runtime) 
     runtime.collect()
 
+# compacts the same heap of small objects in each mode and reports the pause
+# and the most memory the collection allocated on top of the heap. the two
+# are measured on separate runs as tracing allocations skews the timing
+def compare_modes(heap_size: int = 60000):
+    for mode in COMPACTION_MODES:
+        runtime = Runtime(heap_size = heap_size, heap_alignment = 1, mode = mode)
+        build_small_objects(runtime, heap_size // 2)
+        start = time.perf_counter()
+        runtime.collector.collect(runtime.roots.values())
+        elapsed = time.perf_counter() - start
+
+        runtime = Runtime(heap_size = heap_size, heap_alignment = 1, mode = mode)
+        build_small_objects(runtime, heap_size // 2)
+        tracemalloc.start()
+        runtime.collector.collect(runtime.roots.values())
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('{}: pause {:.3f}ms, peak collector memory {:.0f}KiB'.format(mode, elapsed * 1000, peak / 1024))
+
+# fills the heap with one-field objects, every other one dead and the rest
+# in a list reachable from the last of them
+def build_small_objects(runtime: Runtime, count: int):
+    prev = None
+    for i in range(count):
+        obj_id = 's{}'.format(i)
+        ref = runtime.new(Object(obj_id, ['next']))
+        if i % 2 == 0:
+            runtime.set_field(ref, 'next', prev)
+            if prev is not None:
+                runtime.drop('s{}'.format(i - 2))
+            prev = ref
+        else:
+            runtime.drop(obj_id)
+
 # builds the following object graph
 #
 #               ROOT (r1)
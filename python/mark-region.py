@@ -0,0 +1,371 @@
+from typing import Dict, List, Set, Tuple
+import importlib
+import random
+import sys
+import time
+import events
+import copying
+from metrics import Metrics
+from policy import Policy
+from object import Object, Reference
+from heap import Heap, LINES, LINE_SIZE, BLOCK_SIZE
+
+mark_sweep = importlib.import_module('mark-sweep')
+
+# holes a block needs before its survivors are worth evacuating
+EVACUATION_HOLES = 4
+# or how little of its live lines they may fill
+EVACUATION_OCCUPANCY = 0.75
+
+
+# mark-region in the style of Immix: marking is mark-sweep's, but what is
+# reclaimed is whole lines rather than objects, and the line allocator bumps
+# through the free ones. the most fragmented blocks are opportunistically
+# evacuated, their survivors are copied out into free lines of other blocks as
+# long as there is room for them, and whatever doesn't fit stays where it is
+class Collector(mark_sweep.Collector):
+    def __init__(self, heap: Heap, metrics: Metrics = None, workers: int = 1):
+        super().__init__(heap, bitmap = True, metrics = metrics, workers = workers)
+        self.lines_per_block = BLOCK_SIZE // LINE_SIZE
+        # a 1 for every line some survivor of the last collection overlaps
+        self.line_marks = bytearray()
+        # the words of those survivors that start in each block
+        self.block_words: List[int] = []
+        # copies an object into a hole, there is no separate to-space
+        self.evacuator = copying.Collector(heap, heap, copying.BREADTH_FIRST, self.metrics)
+
+    def collect(self, roots: List[Reference]):
+        with self.metrics.pause:
+            events.emit(events.INFO, events.GC, 'beginning collection')
+            self.marks = bytearray(self.heap.size)
+            self.mark_from_roots(roots)
+            with self.metrics.phase('sweep'):
+                live = self.sweep()
+                candidates = self.select_candidates()
+                self.reclaim(candidates)
+            if candidates:
+                with self.metrics.phase('evacuate'):
+                    self.evacuate(roots, live, candidates)
+            self.metrics.count('collections')
+            events.emit(events.INFO, events.GC, 'collection complete, {} words free', self.heap.allocator.free_words)
+
+    # releases the dead and marks the lines of the survivors, which are
+    # returned as (address, obj) in address order
+    def sweep(self) -> List[Tuple[int, Object]]:
+        events.emit(events.INFO, events.SWEEP, 'sweeping the heap line by line')
+        heap = self.heap
+        marks = self.marks
+        freed = freed_words = 0
+        # dead cells on lines that stay in use are never reused, but they
+        # mustn't look like an object either. neighbouring dead objects are
+        # wiped as one run
+        run_start = run_end = 0
+        dead = heap.unmarked_starts(marks)
+        curr_ptr = dead.find(1)
+        while curr_ptr != -1:
+            obj = heap.release(curr_ptr)
+            size = len(obj.slots) + 1
+            if events.level >= events.DEBUG:
+                events.emit(events.DEBUG, events.SWEEP, 'freeing obj {} of size {}', obj.id, size)
+            if curr_ptr != run_end:
+                heap.wipe(run_start, run_end - run_start)
+                run_start = curr_ptr
+            run_end = curr_ptr + size
+            freed += 1
+            freed_words += size
+            curr_ptr = dead.find(1, run_end)
+        heap.wipe(run_start, run_end - run_start)
+        self.count_freed(freed, freed_words)
+
+        line_marks = self.line_marks = bytearray(-(-heap.size // LINE_SIZE))
+        block_words = self.block_words = [0] * -(-heap.size // BLOCK_SIZE)
+        live: List[Tuple[int, Object]] = []
+        contents = heap.contents
+        objs = heap.objs
+        curr_ptr = marks.find(1)
+        while curr_ptr != -1:
+            obj = objs[contents[curr_ptr]]
+            end = curr_ptr + len(obj.slots) + 1
+            live.append((curr_ptr, obj))
+            block_words[curr_ptr // BLOCK_SIZE] += end - curr_ptr
+            first = curr_ptr // LINE_SIZE
+            last = (end - 1) // LINE_SIZE
+            if first == last:
+                line_marks[first] = 1
+            else:
+                line_marks[first:last + 1] = b'\x01' * (last - first + 1)
+            curr_ptr = marks.find(1, end)
+        return live
+
+    def mark_lines(self, address: int, size: int):
+        first = address // LINE_SIZE
+        last = (address + size - 1) // LINE_SIZE
+        self.line_marks[first:last + 1] = b'\x01' * (last - first + 1)
+
+    # the blocks with many holes, or whose survivors leave most of the lines
+    # they keep in use empty, sparsest first for as long as the free lines of
+    # the other blocks can take their survivors. a candidate's own free lines
+    # aren't room, nothing is copied into a block that is being emptied
+    def select_candidates(self) -> List[int]:
+        per_block = self.lines_per_block
+        room = 0
+        fragmented: List[Tuple[float, int, int, int]] = []
+        for block, words in enumerate(self.block_words):
+            lines = self.line_marks[block * per_block:(block + 1) * per_block]
+            live_lines = lines.count(1)
+            free_words = min((block + 1) * BLOCK_SIZE, self.heap.size) - block * BLOCK_SIZE - live_lines * LINE_SIZE
+            room += free_words
+            if words == 0:
+                continue
+            holes = sum(1 for run in lines.split(b'\x01') if run)
+            if holes >= EVACUATION_HOLES or words < EVACUATION_OCCUPANCY * live_lines * LINE_SIZE:
+                fragmented.append((words / live_lines, words, free_words, block))
+
+        candidates: List[int] = []
+        for _, words, free_words, block in sorted(fragmented):
+            if words > room - free_words:
+                continue
+            room -= free_words + words
+            candidates.append(block)
+        return candidates
+
+    # hands every free line to the allocator, except those of the blocks
+    # about to be evacuated so nothing gets copied into them
+    def reclaim(self, candidates: List[int]):
+        line_marks = self.line_marks
+        if candidates:
+            line_marks = bytearray(line_marks)
+            per_block = self.lines_per_block
+            for block in candidates:
+                line_marks[block * per_block:(block + 1) * per_block] = b'\x01' * per_block
+        self.heap.allocator.rebuild(self.free_lines(line_marks, 0, len(line_marks)))
+
+    # (start, size) in words of every run of free lines in [first, end)
+    def free_lines(self, line_marks: bytearray, first: int, end: int) -> List[Tuple[int, int]]:
+        ranges: List[Tuple[int, int]] = []
+        start = line_marks.find(0, first, end)
+        while start != -1:
+            stop = line_marks.find(1, start, end)
+            stop = stop if stop != -1 else end
+            words = min(stop * LINE_SIZE, self.heap.size) - start * LINE_SIZE
+            ranges.append((start * LINE_SIZE, words))
+            start = line_marks.find(0, stop, end)
+        return ranges
+
+    # copies the survivors out of the candidate blocks into whatever free
+    # lines can take them, redirects every reference to what moved and hands
+    # the lines it left behind to the allocator. a survivor there is no
+    # longer room for stays where it is
+    def evacuate(self, roots: List[Reference], live: List[Tuple[int, Object]], candidates: List[int]):
+        events.emit(events.INFO, events.GC, 'evacuating {} fragmented blocks', len(candidates))
+        heap = self.heap
+        allocator = heap.allocator
+        blocks: Set[int] = set(candidates)
+        moved: Dict[int, int] = {}
+        moved_words = 0
+        for address, obj in live:
+            if address // BLOCK_SIZE not in blocks:
+                continue
+            size = len(obj.slots) + 1
+            # objects bigger than a block are never moved
+            if size > BLOCK_SIZE:
+                continue
+            if not allocator.fits(size):
+                continue
+            to_ref = self.evacuator.copy(obj)
+            obj.forwarding_address = None
+            heap.wipe(address, size)
+            moved[address] = to_ref.address
+            moved_words += size
+
+        if moved:
+            for root in roots:
+                to_addr = moved.get(root.address)
+                if to_addr is not None:
+                    root.address = to_addr
+            for _, obj in live:
+                for f_ref in obj.slots:
+                    if f_ref is not None:
+                        to_addr = moved.get(f_ref.address)
+                        if to_addr is not None:
+                            f_ref.address = to_addr
+
+        # the lines of the candidates are worked out again from whatever
+        # stayed behind, an object bigger than a block may reach into one
+        per_block = self.lines_per_block
+        for block in candidates:
+            self.line_marks[block * per_block:(block + 1) * per_block] = bytes(per_block)
+        for address, obj in live:
+            size = len(obj.slots) + 1
+            if address not in moved and (address // BLOCK_SIZE in blocks or (address + size - 1) // BLOCK_SIZE in blocks):
+                self.mark_lines(address, size)
+        for block in candidates:
+            first = block * per_block
+            for start, words in self.free_lines(self.line_marks, first, min(first + per_block, len(self.line_marks))):
+                allocator.free(start, words)
+
+        self.metrics.count('blocks_evacuated', len(candidates))
+        self.metrics.count('objects_evacuated', len(moved))
+        self.metrics.count('words_evacuated', moved_words)
+
+class Runtime:
+    def __init__(self, heap_size: int, heap_alignment: int, workers: int = 1, policy: Policy = None):
+        self.roots: Dict[str, Reference] = {}
+        self.policy: Policy = policy if policy is not None else Policy()
+        self.heap = Heap(size = heap_size, alignment = heap_alignment, policy = LINES)
+        self.metrics = Metrics()
+        self.collector = Collector(self.heap, self.metrics, workers)
+
+    # Mutator methods
+    def new(self, obj: Object) -> Reference:
+        if events.level >= events.DEBUG:
+            events.emit(events.DEBUG, events.ALLOC, 'attempting to allocate new object of size {}, with id: {}', obj.size(), obj.id)
+
+        size = obj.size()
+        if self.policy.should_collect(self.heap, size):
+            self.collect_for(size)
+        ref = self.heap.alloc(size)
+
+        if ref == None:
+            self.collect_for(size)
+            ref = self.heap.alloc(size)
+            old_size = self.heap.size
+            if ref == None and self.heap.resize(self.policy.exhausted(self.heap, size)) > old_size:
+                ref = self.heap.alloc(size)
+            if ref == None:
+                raise Exception("out of memory")
+
+        self.policy.allocated(size)
+        self.write(ref, obj)
+        self.roots[obj.id] = ref
+        return ref
+
+    # a collection the runtime decided on, the policy gets to resize the heap
+    # after it
+    def collect_for(self, size: int):
+        started = time.perf_counter()
+        self.collector.collect(self.roots.values())
+        finished = time.perf_counter()
+        self.heap.resize(self.policy.collected(self.heap, self.heap.live_words, started, finished))
+
+    def read(self, ref: Reference) -> Object:
+        return self.heap.load(ref)
+
+    def write(self, ref: Reference, obj: Object):
+        self.heap.store(ref, obj)
+
+    def set_field(self, src: Reference, field: str, target: Reference):
+        src_object = self.heap.load(src)
+
+        if field not in src_object.fields:
+            raise ValueError('unknown field: {} on obj: {}'.format(field, src_object.id))
+
+        # fields get their own reference so that evacuating a root in place
+        # can't change what a field points at mid-collection
+        if target is not None:
+            target = Reference(target.address, target.size)
+        src_object.fields[field] = target
+
+    # the root gets its own reference, like a field does in set_field, so
+    # moving the root in place can't move a field that shared it
+    def add_root(self, ref: Reference):
+        self.roots[self.heap.load(ref).id] = Reference(ref.address, ref.size)
+
+    def stats(self) -> Dict:
+        return self.metrics.stats()
+
+    def drop(self, obj_id: str):
+        if obj_id in self.roots:
+            del self.roots[obj_id]
+        else:
+            print("attempting to drop object that doesn't exist: {}".format(obj_id))
+            sys.exit(1)
+
+    def collect(self):
+        if events.enabled(events.INFO):
+            print('heap before collection: ')
+            self.heap.visualize()
+        self.collector.collect(self.roots.values())
+        if events.enabled(events.INFO):
+            print('heap after collection: ')
+            self.heap.visualize()
+
+def main():
+    if sys.argv[1:] == ['compare-collectors']:
+        return compare_collectors()
+
+    events.configure(events.DEBUG)
+    runtime = Runtime(heap_size = 100, heap_alignment = 1)
+    build_object_graph(runtime)
+    runtime.collect()
+
+# runs the same fragmenting workload on mark-sweep, mark-compact and
+# mark-region and reports what collecting cost, how fast allocation went and
+# how fragmented the free space was left
+def compare_collectors(heap_size: int = 1 << 14, allocations: int = 100000):
+    for name in ('mark-sweep', 'mark-compact', 'mark-region'):
+        runtime = importlib.import_module(name).Runtime(heap_size = heap_size, heap_alignment = 1)
+        start = time.perf_counter()
+        build_mixed_lifetimes(runtime, allocations)
+        elapsed = time.perf_counter() - start
+        pauses = runtime.stats()['pauses']
+        print('{}: {} pauses, max pause {:.3f}ms, total gc time {:.3f}s, {:.0f} allocations/sec, {:.0f}% fragmented'.format(
+            name, pauses['count'], pauses['max_seconds'] * 1000, pauses['total_seconds'],
+            allocations / elapsed, runtime.heap.fragmentation() * 100))
+    # the workload is there to fragment the heap, so mark-region not
+    # evacuating anything means evacuation is broken
+    if not runtime.stats()['counters'].get('blocks_evacuated'):
+        print('MARK-REGION NEVER EVACUATED A BLOCK')
+        sys.exit(1)
+
+# objects of mixed sizes, most of them dropped straight away and the rest
+# kept for a random while, so survivors end up scattered between holes
+def build_mixed_lifetimes(runtime, allocations: int, held: int = 512):
+    rnd = random.Random(0)
+    kept: List[Tuple[str, Reference]] = []
+    for i in range(allocations):
+        obj_id = 'm{}'.format(i)
+        ref = runtime.new(Object(obj_id, ['f{}'.format(f) for f in range(rnd.choice((1, 1, 2, 3, 6, 12)))]))
+        if kept and rnd.random() < 0.5:
+            runtime.set_field(ref, 'f0', rnd.choice(kept)[1])
+        if rnd.random() < 0.1:
+            if len(kept) == held:
+                runtime.drop(kept.pop(rnd.randrange(held))[0])
+            kept.append((obj_id, ref))
+        else:
+            runtime.drop(obj_id)
+
+# builds the following object graph
+#
+#               ROOT (r1)
+#              /         \
+#             a1         a2
+#            /  \
+#           b1   b2
+#                          c <- this should get collected
+def build_object_graph(runtime: Runtime):
+    r1 = runtime.new(Object('r1', ['a1', 'a2']))
+
+    a1 = runtime.new(Object('a1', ['b1', 'b2']))
+    a2 = runtime.new(Object('a2', []))
+
+    b1 = runtime.new(Object('b1', []))
+    b2 = runtime.new(Object('b2', []))
+
+    # this should get collected
+    c = runtime.new(Object("c", []))
+
+    runtime.set_field(r1, 'a1', a1)
+    runtime.set_field(r1, 'a2', a2)
+
+    runtime.set_field(a1, 'b1', b1)
+    runtime.set_field(a1, 'b2', b2)
+
+    runtime.drop('a1')
+    runtime.drop('a2')
+    runtime.drop('b2')
+    runtime.drop('c')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,102 @@
-from typing import List
+from typing import Dict, List, Tuple
+import random
 import sys
-from object import Object, Reference
-from heap import Heap
-
+import threading
+import time
+import events
+import parallel
+from metrics import Metrics
+from policy import Policy
+from object import Object, Reference, GarbageColor
+from heap import Heap, FREE, ALLOCATED
+
+# words swept per step when sweeping lazily
+LAZY_SWEEP_BLOCK = 256
+# words of marking or sweeping done per allocation when collecting incrementally
+INCREMENTAL_QUANTUM = 64
+# fraction of the heap left free at which an incremental cycle starts
+INCREMENTAL_TRIGGER = 0.25
 
 class Collector:
-    def __init__(self, heap: Heap):
+    def __init__(self, heap: Heap, bitmap: bool = False, lazy: bool = False,
+                 incremental: bool = False, quantum: int = INCREMENTAL_QUANTUM, metrics: Metrics = None,
+                 workers: int = 1, concurrent: bool = False):
+        if incremental and concurrent:
+            raise ValueError('incremental and concurrent marking can not be combined')
+
         self.heap: Heap = heap
+        # processes a stop-the-world mark is spread over, see parallel.py
+        self.workers: int = workers
+        # one mark byte per heap word, set at the object's first word. when
+        # absent the mark lives on the object itself. parallel marking needs it
+        self.marks: bytearray = bytearray(heap.size) if bitmap or parallel.available(workers) else None
+        # incremental collection sweeps lazily too, otherwise the sweep would
+        # be one unbounded pause at the end of every cycle
+        self.lazy: bool = lazy or incremental
+        self.incremental: bool = incremental
+        self.concurrent: bool = concurrent
+        self.quantum: int = quantum
+        # where the lazy sweeper picks up next, None when nothing is left to sweep
+        self.sweep_cursor: int = None
+        # grey objects left to scan while an incremental mark is under way
+        self.marking: bool = False
+        self.grey: List[Reference] = []
+        # concurrent mode: the thread tracing the current cycle, and what it
+        # got through or what went wrong for the final pause to pick up
+        self.marker: threading.Thread = None
+        self.marker_work = (0, 0)
+        self.marker_error: BaseException = None
+        self.metrics: Metrics = metrics if metrics is not None else Metrics()
 
     def collect(self, roots: List[Reference]):
-        print('beginning collection')
-        self.mark_from_roots(roots)
-        self.sweep()
-        print('collection complete. heap is now: {}'.format(self.heap.contents))
+        with self.metrics.pause:
+            events.emit(events.INFO, events.GC, 'beginning collection')
+            if self.marking:
+                # finish the incremental or concurrent cycle already under way
+                self.finish_marking()
+            else:
+                self.finish_sweep()
+                if self.marks is not None:
+                    self.marks = bytearray(self.heap.size)
+                self.mark_from_roots(roots)
+                if self.lazy:
+                    self.sweep_cursor = 0
+                else:
+                    self.sweep()
+            self.metrics.count('collections')
+            events.emit(events.INFO, events.GC, 'collection complete, {} words free', self.heap.allocator.free_words)
 
     def mark_from_roots(self, roots: List[Reference]):
-        print('marking roots')
+        events.emit(events.INFO, events.MARK, 'marking roots')
         worklist: List[Reference] = []
-        for ref in roots:
-            obj = self.heap.load(ref)
-            print('checking root: {}'.format(obj.id))
-            if obj != None and not obj.is_marked():
-                obj.mark()
-                worklist.append(ref)
+        with self.metrics.phase('mark_roots'):
+            for ref in roots:
+                obj = self.heap.load(ref)
+                if obj != None and not self.is_marked(ref, obj):
+                    if events.level >= events.DEBUG:
+                        events.emit(events.DEBUG, events.MARK, 'marking root {}', obj.id)
+                    self.set_mark(ref, obj)
+                    worklist.append(ref)
+        with self.metrics.phase('mark'):
+            if parallel.available(self.workers):
+                self.mark_parallel(worklist)
+            else:
                 self.mark(worklist)
 
+    def mark_parallel(self, worklist: List[Reference]):
+        events.emit(events.INFO, events.MARK, 'marking with {} workers', self.workers)
+        objects, words = parallel.mark(self.heap, self.marks, [ref.address for ref in worklist], self.workers)
+        self.metrics.count('objects_visited', objects)
+        self.metrics.count('words_visited', words)
+
     def mark(self, worklist: List[Reference]):
-        print('marking the worklist')
+        objects = 0
+        words = 0
         while worklist:
             ref: Reference = worklist.pop()
             obj: Object = self.heap.load(ref)
+            objects += 1
+            words += obj.size()
             for f_name, f_ref in obj.fields.items():
                 if f_ref is None:
                     continue
@@ -39,54 +106,345 @@ class Collector:
                     print('ACTIVE REFERENCE LEADING TO DEAD MEMORY. THIS SHOULD BE IMPOSSIBLE')
                     sys.exit(1)
 
-                if not child_obj.is_marked():
-                    child_obj.mark()
+                if not self.is_marked(f_ref, child_obj):
+                    if events.level >= events.DEBUG:
+                        events.emit(events.DEBUG, events.MARK, 'marking {} through {}.{}', child_obj.id, obj.id, f_name)
+                    self.set_mark(f_ref, child_obj)
                     worklist.append(f_ref)
+        self.metrics.count('objects_visited', objects)
+        self.metrics.count('words_visited', words)
+
+    # incremental mode: one bounded slice of collector work per allocation,
+    # starting a new cycle once the heap runs low. concurrent mode only has to
+    # start a cycle or end one here
+    def step(self, roots: List[Reference]):
+        if self.concurrent:
+            return self.concurrent_step(roots)
+        if not self.incremental:
+            return
+
+        if self.marking:
+            with self.metrics.pause, self.metrics.phase('mark'):
+                self.mark_step(self.quantum)
+        elif self.sweep_cursor is not None:
+            with self.metrics.pause:
+                self.sweep_step(self.quantum)
+        elif self.heap.allocator.free_words < self.heap.size * INCREMENTAL_TRIGGER:
+            with self.metrics.pause:
+                with self.metrics.phase('mark_roots'):
+                    self.start_marking(roots)
+                with self.metrics.phase('mark'):
+                    self.mark_step(self.quantum)
+
+    # the roots are snapshotted here and the write barrier preserves every
+    # reference the snapshot could reach, so nothing has to be rescanned later
+    def start_marking(self, roots: List[Reference]):
+        events.emit(events.INFO, events.MARK, 'starting incremental marking')
+        self.finish_sweep()
+        if self.marks is not None:
+            self.marks = bytearray(self.heap.size)
+        self.grey = list(roots)
+        self.marking = True
+
+    # concurrent mode: a cycle starts the same way as an incremental one, but
+    # the grey objects are then traced by a thread of their own while the
+    # mutator carries on. the deletion barrier keeps the snapshot intact, so
+    # once the thread has run out of work all that is left for the final
+    # pause is whatever the barrier has shaded since
+    def concurrent_step(self, roots: List[Reference]):
+        if self.marking:
+            if not self.marker.is_alive():
+                with self.metrics.pause:
+                    self.finish_marking()
+        elif self.heap.allocator.free_words < self.heap.size * INCREMENTAL_TRIGGER:
+            # a lazy sweep still under way has yet to hand back most of the
+            # free space. it is finished a block per allocation rather than in
+            # one long pause at the start of the cycle
+            if self.sweep_cursor is not None:
+                with self.metrics.pause:
+                    self.sweep_step(LAZY_SWEEP_BLOCK)
+                return
+            with self.metrics.pause, self.metrics.phase('mark_roots'):
+                self.start_marking(roots)
+            self.marker_work = (0, 0)
+            self.marker_error = None
+            self.marker = threading.Thread(target = self.mark_concurrently, name = 'marker', daemon = True)
+            self.marker.start()
+
+    # runs on the marker thread. until it is joined the thread is the only one
+    # taking grey objects, the mutator only adds to them through the barrier.
+    # the mutator doesn't count anything while a cycle is being marked, so the
+    # phase timed here is all of metrics the two could both be touching
+    def mark_concurrently(self):
+        try:
+            with self.metrics.phase('concurrent_mark'):
+                self.marker_work = self.scan_grey()
+        except BaseException as e:
+            self.marker_error = e
+
+    # the rest of an incremental cycle, or the final pause of a concurrent one
+    def finish_marking(self):
+        if self.marker is not None:
+            self.marker.join()
+            self.marker = None
+            if self.marker_error is not None:
+                raise self.marker_error
+            objects, words = self.marker_work
+            self.metrics.count('objects_visited', objects)
+            self.metrics.count('words_visited', words)
+            self.metrics.count('concurrent_cycles')
+        with self.metrics.phase('mark'):
+            self.mark_step()
+        if not self.lazy:
+            self.finish_sweep()
+
+    # scans grey objects until `quantum` words have been looked at, or until
+    # the grey set is empty when no quantum is given
+    def mark_step(self, quantum: int = None):
+        objects, work = self.scan_grey(quantum)
+        self.metrics.count('objects_visited', objects)
+        self.metrics.count('words_visited', work)
+
+        if not self.grey:
+            events.emit(events.INFO, events.MARK, 'incremental marking complete')
+            self.marking = False
+            self.sweep_cursor = 0
+
+    # returns the objects and words scanned
+    def scan_grey(self, quantum: int = None) -> Tuple[int, int]:
+        work = 0
+        objects = 0
+        while self.grey and (quantum is None or work < quantum):
+            ref = self.grey.pop()
+            obj = self.heap.load(ref)
+            # snapshot roots go on the grey list without being shaded first
+            if not self.is_marked(ref, obj):
+                self.set_mark(ref, obj)
+            elif obj.color == GarbageColor.BLACK:
+                continue
 
+            obj.color = GarbageColor.BLACK
+            for f_name, f_ref in obj.fields.items():
+                if f_ref is not None:
+                    self.shade(f_ref)
+            work += obj.size()
+            objects += 1
+        return objects, work
+
+    def shade(self, ref: Reference):
+        obj = self.heap.load(ref)
+        if not self.is_marked(ref, obj):
+            self.set_mark(ref, obj)
+            obj.color = GarbageColor.GREY
+            self.grey.append(ref)
+
+    # Yuasa-style deletion barrier: a reference the mutator overwrites while
+    # marking may have been the snapshot's only path to its target
+    def write_barrier(self, old: Reference):
+        if self.marking and old is not None:
+            self.shade(old)
+
+    def is_marked(self, ref: Reference, obj: Object) -> bool:
+        if self.marks is not None:
+            return self.marks[ref.address] == 1
+        return obj.is_marked()
+
+    def set_mark(self, ref: Reference, obj: Object):
+        if self.marks is not None:
+            self.marks[ref.address] = 1
+        else:
+            obj.mark()
 
     def sweep(self):
-        print('sweeping the heap')
-        curr_ptr: int = 0
-
-        while curr_ptr < len(self.heap.contents):
-            obj_id = self.heap.contents[curr_ptr]
+        if parallel.available(self.workers) and self.marks is not None:
+            return self.sweep_parallel()
+        self.sweep_range(0, self.heap.size)
+
+    # the workers work out each chunk's free list and dead objects, releasing
+    # those and building the allocator's free list from the merged lists is
+    # left to this process as only it can change the heap
+    def sweep_parallel(self):
+        with self.metrics.phase('sweep'):
+            events.emit(events.INFO, events.SWEEP, 'sweeping the heap in chunks with {} workers', self.workers)
+            free, dead, freed_words = parallel.sweep(self.heap, self.marks, self.workers)
+            for address in dead:
+                self.heap.release(address)
+            for start, size in free:
+                self.heap.wipe(start, size)
+            self.heap.allocator.rebuild(free)
+            self.count_freed(len(dead), freed_words)
+
+    # sweeps the objects starting in [start, end) and returns the address the
+    # next sweep should pick up from
+    def sweep_range(self, start: int, end: int) -> int:
+        end = min(end, self.heap.size)
+        with self.metrics.phase('sweep'):
+            if self.marks is not None:
+                return self.sweep_range_bitmap(start, end)
+            return self.sweep_range_objects(start, end)
+
+    def sweep_range_objects(self, start: int, end: int) -> int:
+        events.emit(events.INFO, events.SWEEP, 'sweeping the heap from {} to {}', start, end)
+        freed = freed_words = 0
+        curr_ptr: int = start
+        # start of the run of garbage we are currently in, handed back to the
+        # allocator as one block once we hit something live
+        run_start: int = None
+
+        while curr_ptr < end:
+            handle = self.heap.contents[curr_ptr]
+
+            if handle == FREE:
+                curr_ptr = self.end_run(run_start, curr_ptr) + 1
+                run_start = None
+                continue
 
-            if obj_id is None:
+            if handle == ALLOCATED:
+                events.warn('There is probably a bug because we are cleaning up allocated memory that was never filled')
+                if run_start is None:
+                    run_start = curr_ptr
                 curr_ptr += 1
                 continue
 
-            if obj_id == "__ALLOCATED_BUT_EMPTY__":
-                print('There is probably a bug because we are cleaning up allocated memory that was never filled')
-                self.heap.contents[curr_ptr] = None
+            # the tail of an object allocated across a lazy sweep cursor,
+            # its start has already been dealt with
+            if not self.heap.starts[curr_ptr]:
+                self.end_run(run_start, curr_ptr)
+                run_start = None
                 curr_ptr += 1
                 continue
 
-            obj = self.heap.objs[obj_id]
-
-            if not obj.is_marked():
-                print('freeing obj {} of size {}'.format(obj_id, obj.size()))
-                self.heap.free(Reference(curr_ptr, obj.size()))
+            obj = self.heap.objs[handle]
+
+            if obj.is_marked():
+                obj.unmark()
+                self.end_run(run_start, curr_ptr)
+                run_start = None
+            else:
+                if events.level >= events.DEBUG:
+                    events.emit(events.DEBUG, events.SWEEP, 'freeing obj {} of size {}', obj.id, obj.size())
+                self.heap.release(curr_ptr)
+                freed += 1
+                freed_words += obj.size()
+                if run_start is None:
+                    run_start = curr_ptr
 
             curr_ptr += obj.size()
 
+        self.end_run(run_start, curr_ptr)
+        self.count_freed(freed, freed_words)
+        return curr_ptr
+
+    def sweep_range_bitmap(self, start: int, end: int) -> int:
+        events.emit(events.INFO, events.SWEEP, 'sweeping the heap from {} to {} using the mark bitmap', start, end)
+        dead = self.heap.unmarked_starts(self.marks, start, end)
+        run_start: int = None
+        run_end: int = None
+        freed = freed_words = 0
+
+        curr_ptr = dead.find(1)
+        while curr_ptr != -1:
+            obj = self.heap.release(start + curr_ptr)
+            freed += 1
+            freed_words += obj.size()
+            if events.level >= events.DEBUG:
+                events.emit(events.DEBUG, events.SWEEP, 'freeing obj {} of size {}', obj.id, obj.size())
+            if start + curr_ptr != run_end:
+                self.end_run(run_start, run_end)
+                run_start = start + curr_ptr
+            run_end = start + curr_ptr + obj.size()
+            curr_ptr = dead.find(1, curr_ptr + obj.size())
+
+        self.end_run(run_start, run_end)
+        self.count_freed(freed, freed_words)
+        return max(end, run_end or end)
+
+    def count_freed(self, objects: int, words: int):
+        self.metrics.count('objects_freed', objects)
+        self.metrics.count('words_freed', words)
+
+    # lazy mode: sweeps block by block until `size` words can be allocated or
+    # there is nothing left to sweep
+    def sweep_for(self, size: int) -> Reference:
+        if self.sweep_cursor is None:
+            return None
+
+        ref = None
+        with self.metrics.pause:
+            while ref is None and self.sweep_cursor is not None:
+                self.sweep_step(LAZY_SWEEP_BLOCK)
+                ref = self.heap.alloc(size)
+        return ref
+
+    def sweep_step(self, words: int):
+        self.sweep_cursor = self.sweep_range(self.sweep_cursor, self.sweep_cursor + words)
+        if self.sweep_cursor >= self.heap.size:
+            self.sweep_cursor = None
+
+    def finish_sweep(self):
+        if self.sweep_cursor is not None:
+            self.sweep_range(self.sweep_cursor, self.heap.size)
+            self.sweep_cursor = None
+
+    # objects allocated while marking, or into the part of the heap the lazy
+    # sweeper has yet to reach, are marked so they aren't mistaken for garbage
+    def allocated(self, ref: Reference, obj: Object):
+        if self.marking:
+            self.set_mark(ref, obj)
+            obj.color = GarbageColor.BLACK
+        elif self.sweep_cursor is not None and ref.address >= self.sweep_cursor:
+            self.set_mark(ref, obj)
+
+    def pause_report(self) -> Dict[str, float]:
+        pauses = self.metrics.stats()['pauses']
+        return {
+            'pauses': pauses['count'],
+            'max_pause': pauses['max_seconds'],
+            'mean_pause': pauses['mean_seconds'],
+            'total_gc_time': pauses['total_seconds'],
+        }
+
+    def end_run(self, run_start: int, run_end: int) -> int:
+        if run_start is not None:
+            self.heap.free_range(run_start, run_end - run_start)
+        return run_end
+
 class Runtime:
-    def __init__(self, heap_size: int, heap_alignment: int):
+    def __init__(self, heap_size: int, heap_alignment: int, bitmap: bool = False, lazy: bool = False,
+                 incremental: bool = False, quantum: int = INCREMENTAL_QUANTUM, workers: int = 1, policy: Policy = None,
+                 concurrent: bool = False):
         self.roots: Dict[str, Reference] = {}
         self.heap: Heap = Heap(size = heap_size, alignment = heap_alignment)
-        self.collector: Collector = Collector(self.heap)
+        self.metrics = Metrics()
+        self.collector: Collector = Collector(self.heap, bitmap, lazy, incremental, quantum, self.metrics, workers,
+                                              concurrent)
+        self.policy: Policy = policy if policy is not None else Policy()
 
     # Mutator methods
     def new(self, obj: Object) -> Reference:
-        print("attempting to allocate new object of size {}, with id: {}".format(obj.size(), obj.id))
-        ref = self.heap.alloc(obj.size())
+        if events.level >= events.DEBUG:
+            events.emit(events.DEBUG, events.ALLOC, 'attempting to allocate new object of size {}, with id: {}', obj.size(), obj.id)
+        size = obj.size()
+        # while a cycle is still being marked or swept the heap looks fuller
+        # than it is, so the policy is only asked in between cycles
+        if not self.collector.marking and self.collector.sweep_cursor is None and self.policy.should_collect(self.heap, size):
+            self.collect_for(size)
+        self.collector.step(self.roots.values())
+        ref = self.heap.alloc(size)
+        if ref == None:
+            ref = self.collector.sweep_for(size)
 
         if ref == None:
-            self.collector.collect(self.roots.values())
-            ref = self.heap.alloc(obj.size())
+            self.collect_for(size)
+            ref = self.heap.alloc(size) or self.collector.sweep_for(size)
+            if ref == None and self.resize(self.policy.exhausted(self.heap, size)):
+                ref = self.heap.alloc(size)
             if ref == None:
                 raise Exception("out of memory")
   
+        self.policy.allocated(size)
         self.write(ref, obj)
+        self.collector.allocated(ref, obj)
         self.roots[obj.id] = ref
         return ref
     
@@ -102,8 +460,41 @@ class Runtime:
         if field not in src_object.fields:
             raise ValueError('unknown field: {} on obj: {}'.format(field, self.id))
 
+        self.collector.write_barrier(src_object.fields[field])
         src_object.fields[field] = target
 
+    def stats(self) -> Dict:
+        return self.metrics.stats()
+
+    # a collection the runtime decided on, the policy gets to resize the heap
+    # after it. with a lazy sweep still to come the words marked stand in for
+    # what is live
+    def collect_for(self, size: int):
+        marked = self.metrics.counters.get('words_visited', 0)
+        started = time.perf_counter()
+        self.collector.collect(self.roots.values())
+        finished = time.perf_counter()
+        if self.collector.sweep_cursor is None:
+            live_words = self.heap.live_words
+        else:
+            live_words = self.metrics.counters.get('words_visited', 0) - marked
+        self.resize(self.policy.collected(self.heap, live_words, started, finished))
+
+    # true if the heap grew
+    def resize(self, size: int) -> bool:
+        old_size = self.heap.size
+        if self.heap.resize(size) == old_size:
+            return False
+        marks = self.collector.marks
+        if marks is not None and len(marks) < self.heap.size:
+            marks.extend(bytes(self.heap.size - len(marks)))
+        return self.heap.size > old_size
+
+    # new objects are already roots, this is for keeping something alive that
+    # was only reachable through another object
+    def add_root(self, ref: Reference):
+        self.roots[self.heap.load(ref).id] = ref
+
     def drop(self, obj_id: str):
         if obj_id in self.roots:
             del self.roots[obj_id]
@@ -112,17 +503,175 @@ class Runtime:
             sys.exit(1)
 
     def collect(self):
-        print('heap before collection: ')
-        self.heap.visualize()
+        if events.enabled(events.INFO):
+            print('heap before collection: ')
+            self.heap.visualize()
         self.collector.collect(self.roots.values())
-        print('heap after collection: ')
-        self.heap.visualize()
+        if events.enabled(events.INFO):
+            print('heap after collection: ')
+            self.heap.visualize()
 
 def main():
+    if sys.argv[1:] == ['compare-pauses']:
+        return compare_pauses()
+    if sys.argv[1:] == ['stress-concurrent']:
+        return stress_concurrent()
+
+    events.configure(events.DEBUG)
     runtime = Runtime(heap_size = 100, heap_alignment = 1)
     build_object_graph(runtime) 
     runtime.collect()
 
+# runs the same allocation-heavy workload with eager sweeping, lazy sweeping
+# and incremental marking and reports the pauses each one took
+def compare_pauses(heap_size: int = 20000, allocations: int = 20000):
+    modes = {
+        'eager': {},
+        'lazy': {'lazy': True},
+        'incremental': {'incremental': True},
+        'concurrent': {'concurrent': True, 'lazy': True},
+    }
+    for mode, options in modes.items():
+        runtime = Runtime(heap_size = heap_size, heap_alignment = 1, bitmap = True, **options)
+        start = time.perf_counter()
+        build_churn(runtime, allocations)
+        elapsed = time.perf_counter() - start
+
+        report = runtime.collector.pause_report()
+        print('{}: {} pauses, max pause {:.3f}ms, mean pause {:.3f}ms, total gc time {:.3f}s, {:.0f} allocations/sec'.format(
+            mode,
+            report['pauses'],
+            report['max_pause'] * 1000,
+            report['mean_pause'] * 1000,
+            report['total_gc_time'],
+            allocations / elapsed))
+
+# keeps a short linked list of recent objects alive while everything older
+# turns into garbage
+def build_churn(runtime: Runtime, allocations: int, live: int = 100):
+    prev = None
+    for i in range(allocations):
+        ref = runtime.new(Object('o{}'.format(i), ['next']))
+        runtime.set_field(ref, 'next', prev)
+        prev = ref
+        if i >= live:
+            runtime.drop('o{}'.format(i - live))
+            runtime.set_field(runtime.roots['o{}'.format(i - live + 1)], 'next', None)
+
+# random allocations, stores and drops on a concurrent runtime with the
+# interpreter switching threads as often as it can, so the marker gets
+# interleaved with every kind of mutator step. a model of the object graph is
+# kept on the side, and after every finished cycle everything it can reach
+# from the roots has to still be in the heap. at the end two more collections
+# must leave nothing but that behind
+def stress_concurrent(heap_size: int = 4000, operations: int = 100000, seed: int = 0):
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for bitmap in (False, True):
+            runtime = Runtime(heap_size = heap_size, heap_alignment = 1, bitmap = bitmap, concurrent = True)
+            rnd = random.Random(seed)
+            # obj id to field to target id
+            model: Dict[str, Dict[str, str]] = {}
+            held: List[str] = []
+            cycles = 0
+            for i in range(operations):
+                stress_step(runtime, model, held, rnd, 'o{}'.format(i))
+                finished = runtime.metrics.counters.get('concurrent_cycles', 0)
+                if finished != cycles:
+                    cycles = finished
+                    check_reachable(runtime, model)
+            runtime.collect()
+            runtime.collect()
+            live = check_reachable(runtime, model, exact = True)
+
+            pauses = runtime.stats()['pauses']
+            print('{}: {} operations, {} concurrent cycles, no live object was freed and {} objects are left, max pause {:.3f}ms'.format(
+                'mark bitmap' if bitmap else 'object marks', operations, cycles, live, pauses['max_seconds'] * 1000))
+    finally:
+        sys.setswitchinterval(interval)
+
+# one random mutator operation. besides plain stores this moves an object
+# found by following fields from a root over to another object and clears
+# the field it was found through, which is how an object gets hidden from a
+# marker that has already scanned where it is moved to
+def stress_step(runtime: Runtime, model: Dict[str, Dict[str, str]], held: List[str], rnd: random.Random, obj_id: str):
+    r = rnd.random()
+    if r < 0.3 or len(held) < 4:
+        fields = ['f{}'.format(f) for f in range(rnd.randint(0, 4))]
+        try:
+            runtime.new(Object(obj_id, fields))
+        except Exception as e:
+            if str(e) != 'out of memory':
+                raise
+            for _ in range(len(held) // 2):
+                runtime.drop(held.pop(rnd.randrange(len(held))))
+            return
+        model[obj_id] = dict.fromkeys(fields)
+        held.append(obj_id)
+    elif r < 0.55:
+        src = rnd.choice(held)
+        if model[src]:
+            field = rnd.choice(list(model[src]))
+            target = None if rnd.random() < 0.2 else rnd.choice(held)
+            runtime.set_field(runtime.roots[src], field, None if target is None else runtime.roots[target])
+            model[src][field] = target
+    elif r < 0.85:
+        src, src_ref = held_path(runtime, model, rnd, rnd.choice(held))
+        dst, dst_ref = held_path(runtime, model, rnd, rnd.choice(held))
+        full = [field for field, target in model[src].items() if target is not None]
+        if full and model[dst]:
+            field = rnd.choice(full)
+            dst_field = rnd.choice(list(model[dst]))
+            runtime.set_field(dst_ref, dst_field, runtime.read(src_ref).fields[field])
+            runtime.set_field(src_ref, field, None)
+            model[dst][dst_field] = model[src][field]
+            model[src][field] = None
+    else:
+        i = rnd.randrange(len(held))
+        held[i], held[-1] = held[-1], held[i]
+        runtime.drop(held.pop())
+
+# follows up to three random fields from the root `obj_id`
+def held_path(runtime: Runtime, model: Dict[str, Dict[str, str]], rnd: random.Random, obj_id: str):
+    ref = runtime.roots[obj_id]
+    for _ in range(rnd.randint(0, 3)):
+        full = [field for field, target in model[obj_id].items() if target is not None]
+        if not full:
+            break
+        field = rnd.choice(full)
+        ref = runtime.read(ref).fields[field]
+        obj_id = model[obj_id][field]
+    return obj_id, ref
+
+# every object the model can reach has to be found where its referrers point
+# with the id and fields the model gives it. with `exact` nothing else may be
+# left in the heap either. returns how many objects were reached
+def check_reachable(runtime: Runtime, model: Dict[str, Dict[str, str]], exact: bool = False) -> int:
+    heap = runtime.heap
+    seen = set()
+    stack = list(runtime.roots.items())
+    while stack:
+        obj_id, ref = stack.pop()
+        obj = heap.objs.get(heap.contents[ref.address])
+        if obj is None or obj.id != obj_id:
+            print('LIVE OBJECT {} WAS FREED. THIS SHOULD BE IMPOSSIBLE'.format(obj_id))
+            sys.exit(1)
+        if obj_id in seen:
+            continue
+        seen.add(obj_id)
+        for field, target in model[obj_id].items():
+            f_ref = obj.fields[field]
+            if (f_ref is None) != (target is None):
+                print('FIELD {}.{} DOES NOT MATCH THE MODEL'.format(obj_id, field))
+                sys.exit(1)
+            if target is not None:
+                stack.append((target, f_ref))
+    if exact and len(heap.objs) != len(seen):
+        print('{} UNREACHABLE OBJECTS SURVIVED'.format(len(heap.objs) - len(seen)))
+        sys.exit(1)
+    return len(seen)
+
 # builds the following object graph
 #
 #               ROOT (r1)
@@ -0,0 +1,177 @@
+from typing import Dict, List, Tuple
+import json
+import time
+
+# bits of every recorded value kept exactly, the rest only as a power of two.
+# 8 keeps each bucket within 1/128 of the values that land in it
+SIGNIFICANT_BITS = 8
+
+# upper bounds, in seconds, of the pause buckets in the Prometheus export
+PROMETHEUS_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+                      1e-2, 2.5e-2, 5e-2, 1e-1, 2.5e-1, 5e-1, 1.0, 2.5, 5.0, 10.0)
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+# log-linear histogram in the style of HdrHistogram: values are recorded in
+# whole nanoseconds and bucketed on their top SIGNIFICANT_BITS bits, so
+# recording is O(1) and the relative error is bounded whatever the range
+class Histogram:
+    def __init__(self):
+        # lowest value of each bucket to how many values fell in it
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min: int = None
+        self.max: int = None
+
+    def record(self, value: int):
+        shift = max(value.bit_length() - SIGNIFICANT_BITS, 0)
+        bucket = value >> shift << shift
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    # the highest value that is equivalent to the bucket holding `bucket`
+    @staticmethod
+    def highest_equivalent(bucket: int) -> int:
+        shift = max(bucket.bit_length() - SIGNIFICANT_BITS, 0)
+        return bucket + (1 << shift) - 1
+
+    def percentile(self, p: float) -> int:
+        if self.count == 0:
+            return 0
+        rank = max(1, -(-self.count * p // 100))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self.highest_equivalent(bucket), self.max)
+        return self.max
+
+    # how many values were at most `value`, to the histogram's precision
+    def count_at_or_below(self, value: int) -> int:
+        return sum(n for bucket, n in self.buckets.items() if self.highest_equivalent(bucket) <= value)
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class Phase:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics: 'Metrics', name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter_ns() - self.start
+        metrics = self.metrics
+        metrics.phases[self.name] = metrics.phases.get(self.name, 0) + elapsed
+        metrics.phase_counts[self.name] = metrics.phase_counts.get(self.name, 0) + 1
+
+
+# times the outermost of any nested pauses, so a collection that triggers
+# another one still counts as a single pause
+class Pause:
+    __slots__ = ('metrics', 'depth', 'start')
+
+    def __init__(self, metrics: 'Metrics'):
+        self.metrics = metrics
+        self.depth = 0
+
+    def __enter__(self):
+        if self.depth == 0:
+            self.start = time.perf_counter_ns()
+        self.depth += 1
+
+    def __exit__(self, *exc):
+        self.depth -= 1
+        if self.depth == 0:
+            self.metrics.pauses.record(time.perf_counter_ns() - self.start)
+
+
+# what a runtime and its collectors spent their time on and how much they did.
+# every runtime owns one and hands it out to its collectors
+class Metrics:
+    def __init__(self):
+        self.phases: Dict[str, int] = {}       # phase to total nanoseconds
+        self.phase_counts: Dict[str, int] = {} # phase to times entered
+        self.counters: Dict[str, int] = {}
+        self.pauses = Histogram()
+        self.pause = Pause(self)
+
+    # with metrics.phase('mark'): ...
+    def phase(self, name: str) -> Phase:
+        return Phase(self, name)
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def stats(self) -> Dict:
+        pauses = self.pauses
+        return {
+            'phases': {name: {'seconds': ns / 1e9, 'count': self.phase_counts[name]} for name, ns in self.phases.items()},
+            'counters': dict(self.counters),
+            'pauses': {
+                'count': pauses.count,
+                'total_seconds': pauses.total / 1e9,
+                'min_seconds': (pauses.min or 0) / 1e9,
+                'max_seconds': (pauses.max or 0) / 1e9,
+                'mean_seconds': pauses.mean() / 1e9,
+                'percentiles': {str(p): pauses.percentile(p) / 1e9 for p in PERCENTILES},
+            },
+        }
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.stats(), **kwargs)
+
+    def to_prometheus(self, prefix: str = 'gc', labels: Dict[str, str] = None) -> str:
+        return to_prometheus([(labels or {}, self)], prefix)
+
+
+# Prometheus text exposition for any number of labelled runs, every metric
+# family is written once with a sample per run
+def to_prometheus(runs: List[Tuple[Dict[str, str], Metrics]], prefix: str = 'gc') -> str:
+    lines: List[str] = []
+
+    def family(name: str, kind: str, description: str = None):
+        if description is not None:
+            lines.append('# HELP {} {}'.format(name, description))
+        lines.append('# TYPE {} {}'.format(name, kind))
+
+    def sample(name: str, labels: Dict[str, str], value, extra: List[Tuple[str, str]] = ()):
+        pairs = list(labels.items()) + list(extra)
+        label_text = '{' + ','.join('{}="{}"'.format(k, v) for k, v in pairs) + '}' if pairs else ''
+        lines.append('{}{} {}'.format(name, label_text, value))
+
+    name = '{}_phase_seconds_total'.format(prefix)
+    family(name, 'counter', 'Time spent in each collector phase.')
+    for labels, metrics in runs:
+        for phase, ns in sorted(metrics.phases.items()):
+            sample(name, labels, ns / 1e9, [('phase', phase)])
+
+    for counter in sorted({counter for _, metrics in runs for counter in metrics.counters}):
+        name = '{}_{}_total'.format(prefix, counter)
+        family(name, 'counter')
+        for labels, metrics in runs:
+            if counter in metrics.counters:
+                sample(name, labels, metrics.counters[counter])
+
+    name = '{}_pause_seconds'.format(prefix)
+    family(name, 'histogram', 'Time the mutator was stopped for collector work.')
+    for labels, metrics in runs:
+        pauses = metrics.pauses
+        for bound in PROMETHEUS_BUCKETS:
+            sample(name + '_bucket', labels, pauses.count_at_or_below(int(bound * 1e9)), [('le', repr(bound))])
+        sample(name + '_bucket', labels, pauses.count, [('le', '+Inf')])
+        sample(name + '_sum', labels, pauses.total / 1e9)
+        sample(name + '_count', labels, pauses.count)
+    return '\n'.join(lines) + '\n'
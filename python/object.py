@@ -1,8 +1,11 @@
-from typing import List
+from typing import Dict, Iterator, List, Tuple
+from collections.abc import MutableMapping
 from enum import Enum
 
 
 class Reference:
+    __slots__ = ('address', 'size')
+
     def __init__(self, address: int, size: int):
         self.address = address
         self.size = size
@@ -15,20 +18,79 @@ class GarbageColor(Enum):
     WHITE = 4
 
 
+# the field names of a shape of object, shared by every object with that shape
+# so each instance only has to carry its slot values
+class Layout:
+    __slots__ = ('names', 'index')
+
+    interned: Dict[Tuple[str, ...], 'Layout'] = {}
+
+    def __init__(self, names: Tuple[str, ...]):
+        self.names: Tuple[str, ...] = names
+        self.index: Dict[str, int] = {name: i for i, name in enumerate(names)}
+
+    @classmethod
+    def of(cls, names: List[str]) -> 'Layout':
+        key = tuple(names)
+        layout = cls.interned.get(key)
+        if layout is None:
+            layout = cls.interned[key] = cls(key)
+        return layout
+
+
+# a dict-like view of an object's slots keyed by field name
+class Fields(MutableMapping):
+    __slots__ = ('obj',)
+
+    def __init__(self, obj: 'Object'):
+        self.obj = obj
+
+    def __getitem__(self, name: str) -> Reference:
+        return self.obj.slots[self.obj.layout.index[name]]
+
+    def __setitem__(self, name: str, ref: Reference):
+        self.obj.slots[self.obj.layout.index[name]] = ref
+
+    def __delitem__(self, name: str):
+        raise TypeError('fields can not be removed from obj: {}'.format(self.obj.id))
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.obj.layout.index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.obj.layout.names)
+
+    def __len__(self) -> int:
+        return len(self.obj.slots)
+
+    def items(self) -> Iterator[Tuple[str, Reference]]:
+        return zip(self.obj.layout.names, self.obj.slots)
+
+    def values(self) -> Iterator[Reference]:
+        return iter(self.obj.slots)
+
+
 class Object:
+    __slots__ = ('id', 'layout', 'slots', 'marked', 'forwarding_address', 'rc', 'color')
+
     def __init__(self, id: str, fields: List[str]):
         self.id = id
-        self.fields: Dict[str, Reference] = {f:None for f in fields}
+        self.layout: Layout = Layout.of(fields)
+        self.slots: List[Reference] = [None] * len(self.layout.names)
         self.marked: bool = False
         self.forwarding_address: Reference = None
         self.rc: int = 0
         self.color: GarbageColor = None
 
+    @property
+    def fields(self) -> Fields:
+        return Fields(self)
+
     def active_fields(self):
         return filter(lambda x: x is not None, self.fields)
 
     def size(self) -> int:
-        return len(self.fields) + 1
+        return len(self.slots) + 1
 
     def mark(self):
         self.marked = True
@@ -38,4 +100,3 @@ class Object:
 
     def is_marked(self) -> bool:
         return self.marked
-
@@ -0,0 +1,307 @@
+from typing import List, Tuple
+import importlib
+import multiprocessing
+import random
+import sys
+import time
+from multiprocessing import shared_memory
+from object import Object
+from heap import Heap
+
+# marking is spread over forked worker processes. a forked worker sees the
+# heap exactly as it was when the collection started without anything being
+# copied or serialised, and only the mark bitmap, a second bitmap of marked
+# words and the work-stealing deques live in shared memory. where fork isn't
+# available collectors mark sequentially
+FORK = 'fork' in multiprocessing.get_all_start_methods()
+
+# entries in each worker's public deque, the rest of its work stays private
+DEQUE_CAPACITY = 1 << 12
+# objects moved to the public deque at a time, and a worker only publishes
+# once it holds at least twice this many
+PUBLISH_BATCH = 64
+
+# largest number of words one sweep worker is handed at a time
+SWEEP_CHUNK = 1 << 16
+
+# slots of the control block
+IDLE = 0
+DONE = 1
+
+
+def available(workers: int) -> bool:
+    return FORK and workers > 1
+
+
+# marks everything reachable from the (already marked) objects at `roots`
+# into `marks` using `workers` processes, and returns the objects and words
+# that were marked. every word of every marked object is flagged in `live`
+# when it is given. the bitmap ends up exactly as a sequential mark leaves it,
+# workers racing for an object can both scan it but setting a mark twice
+# changes nothing
+def mark(heap: Heap, marks: bytearray, roots: List[int], workers: int, live: bytearray = None) -> Tuple[int, int]:
+    size = len(marks)
+    stride = DEQUE_CAPACITY + 1
+    shm = shared_memory.SharedMemory(create = True, size = 2 * size + 8 * (workers * stride + 2))
+    try:
+        shm.buf[:size] = marks
+        shm.buf[size:] = bytes(shm.size - size)
+
+        context = multiprocessing.get_context('fork')
+        locks = [context.Lock() for _ in range(workers)]
+        control_lock = context.Lock()
+        processes = [context.Process(target = work, args = (index, heap, shm, size, workers, roots[index::workers],
+                                                            locks, control_lock))
+                     for index in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        if any(process.exitcode != 0 for process in processes):
+            raise RuntimeError('a parallel mark worker failed')
+
+        marks[:] = shm.buf[:size]
+        words = shm.buf[size:2 * size].tobytes()
+        if live is not None:
+            live[:] = words
+        return marks.count(1), words.count(1)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+# one worker: drains its private stack, keeps a batch published for thieves
+# while it has plenty, and steals half a deque from someone else once it
+# runs dry. all are done when every worker is idle, which can only happen
+# once every public deque is empty as only a deque's owner fills it
+class Worker:
+    def __init__(self, index: int, heap: Heap, shm: shared_memory.SharedMemory, size: int, workers: int,
+                 locks: List, control_lock):
+        self.index = index
+        self.heap = heap
+        self.workers = workers
+        self.marks = shm.buf[:size]
+        self.words = shm.buf[size:2 * size]
+        self.ints = shm.buf[2 * size:].cast('q')
+        self.stride = DEQUE_CAPACITY + 1
+        self.own = index * self.stride
+        self.control = workers * self.stride
+        self.locks = locks
+        self.control_lock = control_lock
+        self.victims = [i for i in range(workers) if i != index]
+        random.Random(index).shuffle(self.victims)
+
+    def run(self, roots: List[int]):
+        try:
+            stack = list(roots)
+            while True:
+                self.drain(stack)
+                stack = self.find_work()
+                if not stack and not self.idle():
+                    break
+        except BaseException:
+            # lets the others stop instead of waiting on this worker forever
+            self.ints[self.control + DONE] = 1
+            raise
+        finally:
+            self.marks.release()
+            self.words.release()
+            self.ints.release()
+
+    def drain(self, stack: List[int]):
+        marks = self.marks
+        words = self.words
+        ints = self.ints
+        own = self.own
+        contents = self.heap.contents
+        objs = self.heap.objs
+        while stack:
+            if len(stack) >= 2 * PUBLISH_BATCH and ints[own] == 0:
+                self.publish(stack)
+            address = stack.pop()
+            slots = objs[contents[address]].slots
+            words[address:address + len(slots) + 1] = b'\x01' * (len(slots) + 1)
+            for f_ref in slots:
+                if f_ref is not None:
+                    target = f_ref.address
+                    if not marks[target]:
+                        marks[target] = 1
+                        stack.append(target)
+
+    # the oldest entries are handed out, they tend to lead to the most work
+    def publish(self, stack: List[int]):
+        batch = stack[:PUBLISH_BATCH]
+        del stack[:PUBLISH_BATCH]
+        ints = self.ints
+        own = self.own
+        with self.locks[self.index]:
+            count = ints[own]
+            for i, address in enumerate(batch):
+                ints[own + 1 + count + i] = address
+            ints[own] = count + len(batch)
+
+    # takes back everything this worker published, or else half of somebody
+    # else's deque
+    def find_work(self) -> List[int]:
+        if self.ints[self.own]:
+            return self.take(self.index, 1)
+        for victim in self.victims:
+            if self.ints[victim * self.stride]:
+                stack = self.take(victim, 2)
+                if stack:
+                    return stack
+        return []
+
+    def take(self, owner: int, fraction: int) -> List[int]:
+        ints = self.ints
+        base = owner * self.stride
+        with self.locks[owner]:
+            count = ints[base]
+            n = (count + fraction - 1) // fraction
+            taken = ints[base + 1 + count - n:base + 1 + count].tolist()
+            ints[base] = count - n
+        return taken
+
+    # waits until some deque has work again, false once marking is over
+    def idle(self) -> bool:
+        ints = self.ints
+        control = self.control
+        with self.control_lock:
+            ints[control + IDLE] += 1
+            if ints[control + IDLE] == self.workers:
+                ints[control + DONE] = 1
+                return False
+        while True:
+            if ints[control + DONE]:
+                return False
+            if any(ints[victim * self.stride] for victim in self.victims):
+                with self.control_lock:
+                    if ints[control + DONE]:
+                        return False
+                    ints[control + IDLE] -= 1
+                return True
+            time.sleep(0)
+
+def work(index: int, heap: Heap, shm: shared_memory.SharedMemory, size: int, workers: int, roots: List[int],
+         locks: List, control_lock):
+    Worker(index, heap, shm, size, workers, locks, control_lock).run(roots)
+
+
+# sweeps the heap in chunks spread over a pool of `workers` processes and
+# returns the merged free list, the starts of the dead objects and the words
+# they took up. nothing is changed, the caller releases the dead and hands
+# the free list to the allocator
+def sweep(heap: Heap, marks: bytearray, workers: int) -> Tuple[List[Tuple[int, int]], List[int], int]:
+    global sweeping
+    chunk = min(SWEEP_CHUNK, -(-heap.size // workers))
+    # forked pool workers inherit this instead of having it pickled for them
+    sweeping = (heap, marks)
+    try:
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            results = pool.map(sweep_chunk, [(start, min(start + chunk, heap.size)) for start in range(0, heap.size, chunk)])
+    finally:
+        sweeping = None
+
+    free: List[Tuple[int, int]] = []
+    dead: List[int] = []
+    freed_words = 0
+    for runs, chunk_dead, chunk_words in results:
+        # a run that ends where the next chunk's first one starts is one block
+        if runs and free and free[-1][0] + free[-1][1] == runs[0][0]:
+            start, size = free.pop()
+            runs[0] = (start, size + runs[0][1])
+        free += runs
+        dead += chunk_dead
+        freed_words += chunk_words
+    return free, dead, freed_words
+
+sweeping: Tuple[Heap, bytearray] = None
+
+# a chunk owns every object starting in [start, end) along with the free
+# cells behind each of them, even where those run on into the next chunk.
+# the first chunk also owns any free cells in front of the first object
+def sweep_chunk(chunk: Tuple[int, int]) -> Tuple[List[Tuple[int, int]], List[int], int]:
+    heap, marks = sweeping
+    start, end = chunk
+    starts = heap.starts
+    contents = heap.contents
+    objs = heap.objs
+    runs: List[Tuple[int, int]] = []
+    dead: List[int] = []
+    freed_words = 0
+    run_start = run_end = None
+
+    if start == 0:
+        first = starts.find(1)
+        first = first if first != -1 else heap.size
+        if first > 0:
+            run_start, run_end = 0, first
+
+    curr_ptr = starts.find(1, start, end)
+    while curr_ptr != -1:
+        obj_end = curr_ptr + len(objs[contents[curr_ptr]].slots) + 1
+        if marks[curr_ptr]:
+            if run_start is not None:
+                runs.append((run_start, run_end - run_start))
+                run_start = None
+        else:
+            dead.append(curr_ptr)
+            freed_words += obj_end - curr_ptr
+            if run_start is None:
+                run_start = curr_ptr
+            run_end = obj_end
+
+        # whatever lies between this object and the next one is free
+        next_ptr = starts.find(1, obj_end)
+        gap_end = next_ptr if next_ptr != -1 else heap.size
+        if gap_end > obj_end:
+            if run_start is None:
+                run_start = obj_end
+            run_end = gap_end
+        curr_ptr = next_ptr if next_ptr < end else -1
+    if run_start is not None:
+        runs.append((run_start, run_end - run_start))
+    return runs, dead, freed_words
+
+
+def main():
+    mark_sweep = importlib.import_module('mark-sweep')
+    objects = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    sequential = None
+    for workers in (1, 2, 4, 8):
+        runtime = mark_sweep.Runtime(heap_size = 7 * objects, heap_alignment = 1, bitmap = True, workers = workers)
+        build_random_graph(runtime, objects)
+        collector = runtime.collector
+
+        start = time.perf_counter()
+        collector.mark_from_roots(runtime.roots.values())
+        marked = time.perf_counter()
+        collector.sweep()
+        swept = time.perf_counter()
+
+        result = (bytes(collector.marks), sorted(runtime.heap.allocator.starts.items()))
+        if sequential is None:
+            sequential = result
+        print('{} workers: marked {} objects in {:.3f}s, swept in {:.3f}s, {}'.format(
+            workers, collector.marks.count(1), marked - start, swept - marked,
+            'same as sequential' if result == sequential else 'DIFFERENT FROM SEQUENTIAL'))
+
+# a binary tree laid over the objects with one random cross edge per object,
+# only the first object stays a root. a garbage object follows every node
+def build_random_graph(runtime, objects: int):
+    rnd = random.Random(0)
+    refs = []
+    for i in range(objects):
+        refs.append(runtime.new(Object('g{}'.format(i), ['left', 'right', 'cross'])))
+        runtime.new(Object('x{}'.format(i), ['next']))
+        runtime.drop('x{}'.format(i))
+    for i, ref in enumerate(refs):
+        if 2 * i + 2 < objects:
+            runtime.set_field(ref, 'left', refs[2 * i + 1])
+            runtime.set_field(ref, 'right', refs[2 * i + 2])
+        runtime.set_field(ref, 'cross', rnd.choice(refs))
+        if i > 0:
+            runtime.drop('g{}'.format(i))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import importlib
+import random
+import sys
+from heap import Heap
+
+# fraction of the heap in use at which AdaptivePolicy collects
+OCCUPANCY_TRIGGER = 0.8
+# fraction of the heap AdaptivePolicy wants the live data to take up right
+# after a collection
+TARGET_LIVE_RATIO = 0.5
+# fraction of the run AdaptivePolicy tries to keep time spent collecting
+# under, throughput is whatever is left
+TARGET_GC_RATIO = 0.1
+GROWTH_FACTOR = 2
+# fragmentation after a collection above which the next one compacts
+COMPACT_FRAGMENTATION = 0.5
+
+
+# decides when a runtime collects, how big its heap should be and, in the
+# mark-compact runtime, whether a collection compacts. this one collects only
+# once an allocation fails and never resizes anything, which is what every
+# runtime did before there were policies
+class Policy:
+    # whether should_compact can ever say no, the mark-compact runtime
+    # allocates from a free list instead of bumping when it can
+    adaptive_compaction = False
+
+    # asked before every allocation of `size` words
+    def should_collect(self, heap: Heap, size: int) -> bool:
+        return False
+
+    def allocated(self, size: int):
+        pass
+
+    # told about every collection the runtime decided on, with what was still
+    # live afterwards, and returns the size the heap should be
+    def collected(self, heap: Heap, live_words: int, started: float, finished: float) -> int:
+        return heap.size
+
+    def should_compact(self, heap: Heap) -> bool:
+        return True
+
+    # the size to grow the heap to when a collection didn't free `size` words
+    def exhausted(self, heap: Heap, size: int) -> int:
+        return heap.size
+
+
+# collects on occupancy or after an allocation budget, and sizes the heap
+# after every collection so the live data takes up about target_live_ratio of
+# it. if collecting takes up more than target_gc_ratio of the time the heap
+# grows regardless, and it only shrinks when collections are well within
+# budget. a collection compacts once the last one left the heap fragmented
+class AdaptivePolicy(Policy):
+    def __init__(self, occupancy_trigger: float = OCCUPANCY_TRIGGER, allocation_budget: int = None,
+                 target_live_ratio: float = TARGET_LIVE_RATIO, target_gc_ratio: float = TARGET_GC_RATIO,
+                 growth_factor: float = GROWTH_FACTOR, min_heap: int = 0, max_heap: int = None,
+                 compact_fragmentation: float = COMPACT_FRAGMENTATION):
+        self.occupancy_trigger = occupancy_trigger
+        self.allocation_budget = allocation_budget
+        self.target_live_ratio = target_live_ratio
+        self.target_gc_ratio = target_gc_ratio
+        self.growth_factor = growth_factor
+        self.min_heap = min_heap
+        self.max_heap = max_heap
+        self.compact_fragmentation = compact_fragmentation
+        self.adaptive_compaction = compact_fragmentation is not None
+
+        self.allocated_words = 0
+        self.live_words = 0
+        # when the last collection finished, None before the first one
+        self.last_collection: float = None
+        self.fragmentation = 0.0
+
+    def should_collect(self, heap: Heap, size: int) -> bool:
+        if self.allocation_budget is not None and self.allocated_words + size > self.allocation_budget:
+            return True
+        if self.occupancy_trigger is None:
+            return False
+        limit = heap.size * self.occupancy_trigger
+        # with more live data than the trigger allows, collecting again right
+        # away would free next to nothing. wait for half the free space instead
+        if self.live_words >= limit:
+            limit = self.live_words + (heap.size - self.live_words) / 2
+        return heap.size - heap.free_words + size > limit
+
+    def allocated(self, size: int):
+        self.allocated_words += size
+
+    def collected(self, heap: Heap, live_words: int, started: float, finished: float) -> int:
+        gc_ratio = None
+        if self.last_collection is not None:
+            gc_ratio = (finished - started) / max(finished - self.last_collection, 1e-9)
+        self.last_collection = finished
+        self.allocated_words = 0
+        self.live_words = live_words
+        self.fragmentation = heap.fragmentation()
+
+        size = heap.size
+        wanted = live_words / self.target_live_ratio
+        if gc_ratio is not None and gc_ratio > self.target_gc_ratio:
+            size = max(wanted, heap.size * self.growth_factor)
+        elif wanted > heap.size:
+            size = wanted
+        elif gc_ratio is not None and gc_ratio < self.target_gc_ratio / 2 and wanted < heap.size / 2:
+            size = max(wanted, heap.size / self.growth_factor)
+        return self.clamp(int(size))
+
+    def should_compact(self, heap: Heap) -> bool:
+        return self.compact_fragmentation is None or self.fragmentation >= self.compact_fragmentation
+
+    def exhausted(self, heap: Heap, size: int) -> int:
+        needed = heap.size - heap.free_words + size
+        return max(self.clamp(int(max(heap.size * self.growth_factor, needed / self.target_live_ratio))), heap.size)
+
+    def clamp(self, size: int) -> int:
+        size = max(size, self.min_heap)
+        if self.max_heap is not None:
+            size = min(size, self.max_heap)
+        return size
+
+
+# runs every benchmark workload on the runtimes that take a policy, once with
+# the default policy on a fixed heap and once adaptively from a small heap
+def main():
+    benchmark = importlib.import_module('benchmark')
+    scale = int(sys.argv[1]) if len(sys.argv) > 1 else benchmark.DEFAULT_SCALE
+    print('{:<18} {:<13} {:<9} {:>9} {:>7} {:>10} {:>6}'.format(
+        'workload', 'collector', 'policy', 'gc time', 'pauses', 'heap', 'frag'))
+    for workload in benchmark.WORKLOADS:
+        for collector in ('copying', 'mark-sweep', 'mark-compact', 'mark-region'):
+            for name in ('fixed', 'adaptive'):
+                if name == 'fixed':
+                    policy, heap_size = Policy(), benchmark.DEFAULT_HEAP_SIZE
+                else:
+                    policy, heap_size = AdaptivePolicy(), benchmark.DEFAULT_HEAP_SIZE // 8
+                runtime = importlib.import_module(collector).Runtime(heap_size = heap_size, heap_alignment = 1, policy = policy)
+                m = benchmark.Mutator(collector, runtime)
+                try:
+                    benchmark.WORKLOADS[workload](m, random.Random(0), scale)
+                except Exception as e:
+                    if str(e) != 'out of memory':
+                        raise
+                    print('{:<18} {:<13} {:<9} {}'.format(workload, collector, name, e))
+                    continue
+                pauses = runtime.stats()['pauses']
+                heap = benchmark.main_heap_of(runtime)
+                print('{:<18} {:<13} {:<9} {:>8.3f}s {:>7} {:>10} {:>5.0f}%'.format(
+                    workload, collector, name, pauses['total_seconds'], pauses['count'],
+                    sum(h.size for h in benchmark.heaps_of(runtime)), heap.fragmentation() * 100))
+
+if __name__ == "__main__":
+    main()
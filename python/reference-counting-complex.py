@@ -1,74 +1,40 @@
-from typing import List
+from typing import Dict, List
+import sys
+import events
+from metrics import Metrics
 from object import Reference, GarbageColor, Object
 from heap import Heap
 
-
-class Heap:
-    def __init__(self, size: int, alignment: int):
-        if size % alignment != 0:
-            msg = 'Heap size needs to be a multiple of given alignment: {}, but was {}'.format(alignment, size)
-            raise ValueError(msg)
-
-        self.size = size
-        self.contents = [None for _ in range(size)]
-        self.objs = {} # obj id to obj
-
-    def load(self, ref: Reference) -> Object:
-        obj_id = self.contents[ref.address]
-        return self.objs[obj_id]
-    
-    def store(self, ref: Reference, obj: Object):
-        if ref.size != obj.size():
-            print('Trying to store object of size: {} in a reference slot of size: {}'.format(obj.size(), ref.size))
-            sys.exit(1)
-
-        for i in range(ref.address, ref.address + ref.size):
-            self.contents[i] = obj.id
-        
-        self.objs[obj.id] = obj
-
-    def alloc(self, size: int) -> Reference:
-        print('trying to allocate a chunk of size: {} while heap is: {}'.format(size, self.contents))
-        
-        # need to find the first range of `size` that is all `None`s
-        in_a_row = 0
-        for n, content in enumerate(self.contents):
-            if content is None:
-                in_a_row += 1
-
-                if in_a_row == size:
-                    starting_address = n - size + 1
-                    print('found a valid chunk to allocate starting at address: {}'.format(starting_address))
-                    for i in range(starting_address, starting_address + size):
-                        self.contents[i] = "__ALLOCATED_BUT_EMPTY__"
-                    return Reference(starting_address, size)
-            else:
-                in_a_row = 0
-
-        return None
-
-    def free(self, ref: Reference):
-        obj_id = self.contents[ref.address]
-        del self.objs[obj_id]
-
-        for i in range(ref.address, ref.address + ref.size):
-            self.contents[i] = None
+# buffered candidates, or the fraction of the heap in use, at which the cycle
+# collector runs
+CANDIDATE_LIMIT = 256
+OCCUPANCY_LIMIT = 0.9
 
 
 class Runtime:
-    def __init__(self, heap_size: int, heap_alignment: int):
-        self.roots = []
+    def __init__(self, heap_size: int, heap_alignment: int, candidate_limit: int = CANDIDATE_LIMIT,
+                 occupancy_limit: float = OCCUPANCY_LIMIT):
+        self.roots: Dict[str, Reference] = {}
         self.heap = Heap(size = heap_size, alignment = heap_alignment)
-        self.candidates: Set[Reference] = set()
+        # possible roots of garbage cycles, keyed by address. being in here is
+        # what Bacon and Rajan call being buffered
+        self.candidates: Dict[int, Reference] = {}
+        self.candidate_limit = candidate_limit
+        self.occupancy_limit = occupancy_limit
+        self.metrics = Metrics()
 
     # Mutator methods
     def new(self, obj: Object) -> Reference:
-        print("attempting to allocate new object of size {}, with id: {}".format(obj.size(), obj.id))
+        if events.level >= events.DEBUG:
+            events.emit(events.DEBUG, events.ALLOC, 'attempting to allocate new object of size {}, with id: {}', obj.size(), obj.id)
+
+        if self.candidates and self.occupancy() >= self.occupancy_limit:
+            self.collect()
 
         ref = self.heap.alloc(obj.size())
 
         if ref == None:
-            self.collect(self.roots)
+            self.collect()
             ref = self.heap.alloc(obj.size())
             if ref == None:
                 raise Exception("out of memory")
@@ -76,113 +42,202 @@ class Runtime:
         self.write(ref, obj)
         return ref
     
+    def read(self, ref: Reference) -> Object:
+        return self.heap.load(ref)
+
     def write(self, ref: Reference, obj: Object):
         self.heap.store(ref, obj)
 
+    def stats(self) -> Dict:
+        return self.metrics.stats()
+
     def add_root(self, ref: Reference):
-        self.roots.append(ref)
+        obj_id = self.heap.load(ref).id
+        if obj_id in self.roots:
+            return
+        self.roots[obj_id] = ref
+        self.add_reference(ref)
+
+    def drop(self, obj_id: str):
+        if obj_id not in self.roots:
+            print("attempting to drop object that doesn't exist: {}".format(obj_id))
+            sys.exit(1)
+
+        self.delete_reference(self.roots.pop(obj_id))
+        if len(self.candidates) >= self.candidate_limit:
+            self.collect()
 
     def set_field(self, src: Reference, field: str, target: Reference):
         src_object = self.heap.load(src)
 
         if field not in src_object.fields:
-            raise ValueError('unknown field: {} on obj: {}'.format(field, self.id))
+            raise ValueError('unknown field: {} on obj: {}'.format(field, src_object.id))
 
         self.add_reference(target)
-        self.delete_reference(src_object.fields[field])
+        old = src_object.fields[field]
         src_object.fields[field] = target
+        self.delete_reference(old)
+
+        if len(self.candidates) >= self.candidate_limit:
+            self.collect()
+
+    def occupancy(self) -> float:
+        return 1 - self.heap.allocator.free_words / self.heap.size
 
     def add_reference(self, ref: Reference):
         if ref is not None:
             obj = self.heap.load(ref)
             obj.rc = obj.rc + 1
             obj.color = GarbageColor.BLACK
+            if events.level >= events.TRACE:
+                events.emit(events.TRACE, events.RC_CHANGE, 'rc of obj {} went up to {}', obj.id, obj.rc)
 
     def delete_reference(self, ref: Reference):
         if ref is not None:
             obj = self.heap.load(ref)
             obj.rc = obj.rc - 1
+            if events.level >= events.TRACE:
+                events.emit(events.TRACE, events.RC_CHANGE, 'rc of obj {} went down to {}', obj.id, obj.rc)
             if obj.rc == 0:
                 self.release(ref)
             else:
-                self.candidate(ref)
+                self.candidate(ref, obj)
 
+    # frees `ref` along with everything that only it was keeping alive. buffered
+    # objects are left for the cycle collector to free
     def release(self, ref: Reference):
-        obj = self.heap.load(ref)
-        for f_name, f_ref in obj.fields.items():
-            delete_reference(f_ref)
-        obj.color = GarbageColor.BLACK
-        if obj not in self.candidates:
-            self.heap.free(ref)
+        freed = freed_words = 0
+        with self.metrics.pause, self.metrics.phase('release'):
+            worklist: List[Reference] = [ref]
+            while worklist:
+                ref = worklist.pop()
+                obj = self.heap.load(ref)
+                for f_ref in obj.fields.values():
+                    if f_ref is None:
+                        continue
+                    child_obj = self.heap.load(f_ref)
+                    child_obj.rc = child_obj.rc - 1
+                    if child_obj.rc == 0:
+                        worklist.append(f_ref)
+                    else:
+                        self.candidate(f_ref, child_obj)
+                obj.color = GarbageColor.BLACK
+                if ref.address not in self.candidates:
+                    self.heap.free(ref)
+                    freed += 1
+                    freed_words += ref.size
+        self.metrics.count('objects_freed', freed)
+        self.metrics.count('words_freed', freed_words)
 
-    def candidate(self, ref: Reference):
-        obj = self.heap.load(ref)
+    def candidate(self, ref: Reference, obj: Object):
         if obj.color != GarbageColor.PURPLE:
             obj.color = GarbageColor.PURPLE
-            self.candidates.add(ref)
+            if ref.address not in self.candidates:
+                self.candidates[ref.address] = ref
 
+    # synchronous trial deletion over the whole candidate buffer at once. every
+    # phase walks the graph with an explicit stack, so deep structures don't
+    # run into the recursion limit, and each phase shares its colouring across
+    # all the candidates so no object is traced twice per phase
     def collect(self):
-        self.mark_candidates()
-        for ref in self.candidates:
-            self.scan(ref)
-        self.collect_candidates()
+        events.emit(events.INFO, events.GC, 'collecting cycles from {} candidates', len(self.candidates))
+        with self.metrics.pause, self.metrics.phase('cycle_collection'):
+            self.metrics.count('candidates', len(self.candidates))
+            self.mark_candidates()
+            for ref in self.candidates.values():
+                self.scan(ref)
+            self.collect_candidates()
+            self.metrics.count('collections')
 
     def mark_candidates(self):
-        for ref in self.candidates:
+        for address, ref in list(self.candidates.items()):
             obj = self.heap.load(ref)
-            if obj.color == GarbageColor.PURPLE:
-                self.mark_grey(obj)
+            if obj.color == GarbageColor.PURPLE and obj.rc > 0:
+                self.mark_grey(ref)
             else:
-                self.candidates.remove(obj)
+                del self.candidates[address]
                 if obj.color == GarbageColor.BLACK and obj.rc == 0:
                     self.heap.free(ref)
-
-    def mark_grey(self, obj: Object):
-        if obj.color != GarbageColor.GREY:
+                    self.metrics.count('objects_freed')
+                    self.metrics.count('words_freed', ref.size)
+
+    def mark_grey(self, ref: Reference):
+        objects = 0
+        worklist: List[Reference] = [ref]
+        while worklist:
+            obj = self.heap.load(worklist.pop())
+            if obj.color == GarbageColor.GREY:
+                continue
             obj.color = GarbageColor.GREY
-            for f_name, f_ref in obj.fields.items():
-                child_obj = self.heap.load(f_ref)
-                if child_obj is not None:
-                    child_obj.rc = child_obj.rc - 1
-                    self.mark_grey(child_obj)
+            objects += 1
+            for f_ref in obj.fields.values():
+                if f_ref is not None:
+                    self.heap.load(f_ref).rc -= 1
+                    worklist.append(f_ref)
+        self.metrics.count('objects_visited', objects)
 
     def scan(self, ref: Reference):
-        obj = self.heap.load(ref)
-        if obj.color == GarbageColor.GREY:
+        worklist: List[Reference] = [ref]
+        while worklist:
+            ref = worklist.pop()
+            obj = self.heap.load(ref)
+            if obj.color != GarbageColor.GREY:
+                continue
             if obj.rc > 0:
-                self.scan_black(obj)
+                self.scan_black(ref)
             else:
                 obj.color = GarbageColor.WHITE
-                for f_name, f_ref in obj.fields.items():
-                    child_obj = self.heap.load(f_ref)
-                    if child_obj is not None:
-                        self.scan(child_obj)
-
-    def scan_black(self, obj: Object):
-        obj.color = GarbageColor.BLACK
-        for f_name, f_ref in obj.fields.items():
-            child_obj = self.heap.load(f_ref)
-            if child_obj is not None:
+                for f_ref in obj.fields.values():
+                    if f_ref is not None:
+                        worklist.append(f_ref)
+
+    # something outside the candidate's subgraph still points at `ref`, so it
+    # and everything it reaches get their counts back
+    def scan_black(self, ref: Reference):
+        self.heap.load(ref).color = GarbageColor.BLACK
+        worklist: List[Reference] = [ref]
+        while worklist:
+            obj = self.heap.load(worklist.pop())
+            for f_ref in obj.fields.values():
+                if f_ref is None:
+                    continue
+                child_obj = self.heap.load(f_ref)
                 child_obj.rc = child_obj.rc + 1
                 if child_obj.color != GarbageColor.BLACK:
-                    self.scan_black(child_obj)
+                    child_obj.color = GarbageColor.BLACK
+                    worklist.append(f_ref)
 
     def collect_candidates(self):
-        while self.candidates:
-            ref = self.candidates.pop()
-            self.collect_white(ref)
-
-    def collect_white(self, ref: Reference):
-        obj = self.heap.load(ref)
-        if obj.color == GarbageColor.WHITE and not self.candidates.contains(obj):
-            obj.color = GarbageColor.BLACK
-            for f_name, f_ref in obj.fields.items():
-                child_obj = self.heap.load(f_ref)
-                if child_obj is not None:
-                    self.collect_white(child_obj)
+        candidates = list(self.candidates.values())
+        self.candidates = {}
+        garbage: List[Reference] = []
+        for ref in candidates:
+            self.collect_white(ref, garbage)
+        for ref in garbage:
             self.heap.free(ref)
+        self.metrics.count('objects_freed', len(garbage))
+        self.metrics.count('words_freed', sum(ref.size for ref in garbage))
+        self.metrics.count('cyclic_objects_freed', len(garbage))
+
+    # gathers the white objects reachable from `ref`, they are only freed once
+    # every candidate has been walked so no walk trips over a freed object. a
+    # candidate an earlier walk already gathered is black by its own turn, so
+    # unlike Bacon and Rajan there is no need to skip buffered objects
+    def collect_white(self, ref: Reference, garbage: List[Reference]):
+        worklist: List[Reference] = [ref]
+        while worklist:
+            ref = worklist.pop()
+            obj = self.heap.load(ref)
+            if obj.color != GarbageColor.WHITE:
+                continue
+            obj.color = GarbageColor.BLACK
+            for f_ref in obj.fields.values():
+                if f_ref is not None:
+                    worklist.append(f_ref)
+            garbage.append(ref)
 
 def main():
+    events.configure(events.DEBUG)
     runtime = Runtime(heap_size = 100, heap_alignment = 1)
     build_object_graph(runtime) 
     runtime.collect()
@@ -1,59 +1,248 @@
-from typing import List
+from typing import Dict, List, Tuple
+import random
+import sys
+import time
+import events
+from metrics import Metrics
 from object import Object, Reference
 from heap import Heap
 
+EAGER = 'eager'
+DEFERRED = 'deferred'
+COALESCED = 'coalesced'
+RC_MODES = (EAGER, DEFERRED, COALESCED)
+
+# zero count table entries, or logged objects in coalesced mode, that make the
+# next pointer store run a collection
+ZCT_LIMIT = 256
+LOG_LIMIT = 256
+
 
 class Runtime:
-    def __init__(self, heap_size: int, heap_alignment: int):
-        self.roots = []
+    def __init__(self, heap_size: int, heap_alignment: int, mode: str = EAGER):
+        if mode not in RC_MODES:
+            raise ValueError('unknown reference counting mode: {}, expected one of {}'.format(mode, RC_MODES))
+
+        self.roots: Dict[str, Reference] = {}
         self.heap = Heap(size = heap_size, alignment = heap_alignment)
+        self.mode = mode
+        # objects whose count has dropped to zero but that the uncounted roots
+        # may still point at, keyed by address
+        self.zct: Dict[int, Reference] = {}
+        # stands in for the mutator's stack: objects it has been handed by
+        # `new` but not yet stored anywhere or rooted, keyed by address. they
+        # are protected like roots until then
+        self.stack: Dict[int, Reference] = {}
+        # coalesced mode: every object written since the last collection, with
+        # its fields as they were before the first of those writes
+        self.log: Dict[int, Tuple[Reference, List[Reference]]] = {}
+        self.rc_updates = 0
+        self.metrics = Metrics()
 
     # Mutator methods
     def new(self, obj: Object) -> Reference:
-        print("attempting to allocate new object of size {}, with id: {}".format(obj.size(), obj.id))
+        if events.level >= events.DEBUG:
+            events.emit(events.DEBUG, events.ALLOC, 'attempting to allocate new object of size {}, with id: {}', obj.size(), obj.id)
 
         ref = self.heap.alloc(obj.size())
 
+        if ref == None and self.mode != EAGER:
+            self.collect()
+            ref = self.heap.alloc(obj.size())
+
         if ref == None:
             raise Exception("out of memory")
   
         self.write(ref, obj)
+        if self.mode != EAGER:
+            self.zct[ref.address] = ref
+            self.stack[ref.address] = ref
         return ref
     
+    def read(self, ref: Reference) -> Object:
+        return self.heap.load(ref)
+
     def write(self, ref: Reference, obj: Object):
         self.heap.store(ref, obj)
 
+    def stats(self) -> Dict:
+        self.metrics.counters['rc_updates'] = self.rc_updates
+        return self.metrics.stats()
+
     def add_root(self, ref: Reference):
-        self.roots.append(ref)
+        obj_id = self.heap.load(ref).id
+        self.stack.pop(ref.address, None)
+        if obj_id in self.roots:
+            return
+        self.roots[obj_id] = ref
+        if self.mode == EAGER:
+            self.add_reference(ref)
+
+    def drop(self, obj_id: str):
+        if obj_id not in self.roots:
+            print("attempting to drop object that doesn't exist: {}".format(obj_id))
+            sys.exit(1)
+
+        ref = self.roots.pop(obj_id)
+        if self.mode == EAGER:
+            self.delete_reference(ref)
+        elif self.heap.load(ref).rc == 0:
+            # nothing counted pointed at it, only the root we just took away
+            self.zct[ref.address] = ref
 
     def set_field(self, src: Reference, field: str, target: Reference):
         src_object = self.heap.load(src)
 
         if field not in src_object.fields:
-            raise ValueError('unknown field: {} on obj: {}'.format(field, self.id))
+            raise ValueError('unknown field: {} on obj: {}'.format(field, src_object.id))
 
-        self.add_reference(target)
-        self.delete_reference(src_object.fields[field])
+        if target is not None:
+            self.stack.pop(target.address, None)
+        if self.mode == COALESCED:
+            if src.address not in self.log:
+                self.log[src.address] = (src, list(src_object.slots))
+        else:
+            self.add_reference(target)
+            self.delete_reference(src_object.fields[field])
         src_object.fields[field] = target
 
+        if len(self.log) >= LOG_LIMIT or len(self.zct) >= ZCT_LIMIT:
+            self.collect()
+
     def add_reference(self, ref: Reference):
         if ref is not None:
             obj = self.heap.load(ref)
             obj.rc = obj.rc + 1
+            self.rc_updates += 1
+            if events.level >= events.TRACE:
+                events.emit(events.TRACE, events.RC_CHANGE, 'rc of obj {} went up to {}', obj.id, obj.rc)
 
     def delete_reference(self, ref: Reference):
         if ref is not None:
             obj = self.heap.load(ref)
             obj.rc = obj.rc - 1
+            self.rc_updates += 1
+            if events.level >= events.TRACE:
+                events.emit(events.TRACE, events.RC_CHANGE, 'rc of obj {} went down to {}', obj.id, obj.rc)
             if obj.rc == 0:
-                for f_name, f_ref in obj.fields:
-                    delete_reference(f_ref)
+                if self.mode == EAGER:
+                    self.release(ref)
+                else:
+                    self.zct[ref.address] = ref
+
+    # frees `ref` along with everything that only it was keeping alive
+    def release(self, ref: Reference):
+        freed = freed_words = 0
+        with self.metrics.pause, self.metrics.phase('release'):
+            worklist: List[Reference] = [ref]
+            while worklist:
+                ref = worklist.pop()
+                obj = self.heap.load(ref)
+                for f_ref in obj.fields.values():
+                    if f_ref is not None:
+                        child_obj = self.heap.load(f_ref)
+                        child_obj.rc = child_obj.rc - 1
+                        self.rc_updates += 1
+                        if child_obj.rc == 0:
+                            worklist.append(f_ref)
+                self.zct.pop(ref.address, None)
                 self.heap.free(ref)
+                freed += 1
+                freed_words += ref.size
+        self.metrics.count('objects_freed', freed)
+        self.metrics.count('words_freed', freed_words)
+
+    # deferred and coalesced modes: applies the logged writes, then frees
+    # whatever in the zero count table the roots and the stack don't point at.
+    # whatever they kept alive with no other references goes back in the table
+    def collect(self):
+        if self.mode == EAGER:
+            return
+
+        with self.metrics.pause, self.metrics.phase('deferred_collection'):
+            if self.mode == COALESCED:
+                self.apply_log()
+
+            protected = list(self.roots.values()) + list(self.stack.values())
+            for ref in protected:
+                self.add_reference(ref)
+            while self.zct:
+                address, ref = self.zct.popitem()
+                if self.heap.load(ref).rc == 0:
+                    self.release(ref)
+            for ref in protected:
+                self.delete_reference(ref)
+            self.metrics.count('collections')
+
+    # only the net change per target is applied, so a field overwritten many
+    # times between collections costs one update for its first and last value
+    def apply_log(self):
+        deltas: Dict[int, int] = {}
+        targets: Dict[int, Reference] = {}
+        for src, old_slots in self.log.values():
+            for f_ref in self.heap.load(src).slots:
+                if f_ref is not None:
+                    deltas[f_ref.address] = deltas.get(f_ref.address, 0) + 1
+                    targets[f_ref.address] = f_ref
+            for f_ref in old_slots:
+                if f_ref is not None:
+                    deltas[f_ref.address] = deltas.get(f_ref.address, 0) - 1
+                    targets[f_ref.address] = f_ref
+        self.log = {}
+
+        # increments go first so nothing drops to zero on its way up
+        for address, delta in deltas.items():
+            if delta > 0:
+                self.heap.load(targets[address]).rc += delta
+                self.rc_updates += 1
+        for address, delta in deltas.items():
+            if delta < 0:
+                obj = self.heap.load(targets[address])
+                obj.rc += delta
+                self.rc_updates += 1
+                if obj.rc == 0:
+                    self.zct[address] = targets[address]
 
 def main():
+    if sys.argv[1:] == ['compare-modes']:
+        return compare_modes()
+
+    events.configure(events.DEBUG)
     runtime = Runtime(heap_size = 100, heap_alignment = 1)
     build_object_graph(runtime) 
 
+# runs the same write-heavy workload in every mode and reports how many
+# reference count updates each one needed
+def compare_modes(heap_size: int = 20000, writes: int = 50000):
+    for mode in RC_MODES:
+        runtime = Runtime(heap_size = heap_size, heap_alignment = 1, mode = mode)
+        start = time.perf_counter()
+        build_write_heavy(runtime, writes)
+        runtime.collect()
+        elapsed = time.perf_counter() - start
+        print('{}: {} rc updates for {} writes, {} objects live, {:.3f}s'.format(
+            mode, runtime.rc_updates, writes, len(runtime.heap.objs), elapsed))
+
+# a fixed set of objects hanging off one root whose fields keep getting
+# pointed at each other and at freshly allocated objects
+def build_write_heavy(runtime: Runtime, writes: int, width: int = 64):
+    rnd = random.Random(0)
+    root = runtime.new(Object('root', ['f{}'.format(i) for i in range(width)]))
+    runtime.add_root(root)
+    nodes = []
+    for i in range(width):
+        node = runtime.new(Object('n{}'.format(i), ['left', 'right']))
+        runtime.set_field(root, 'f{}'.format(i), node)
+        nodes.append(node)
+
+    for i in range(writes):
+        src = rnd.choice(nodes)
+        if i % 8 == 0:
+            target = runtime.new(Object('t{}'.format(i), ['left', 'right']))
+        else:
+            target = rnd.choice(nodes)
+        runtime.set_field(src, rnd.choice(['left', 'right']), target)
+
 # builds the following object graph
 #
 #               ROOT (r1)
@@ -0,0 +1,324 @@
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+import argparse
+import importlib
+import random
+from object import Object, Reference
+
+# a trace is MAGIC followed by one record per mutator operation. every record
+# is an opcode byte and then its operands:
+#
+#   NEW / NEW_UNROOTED  object id, layout
+#   SET_FIELD           source id, field name, target id or none
+#   DROP                object id
+#   ADD_ROOT            object id
+#
+# integers are LEB128 varints and object ids are length prefixed utf-8, with a
+# length of 0 standing for none and n + 1 for n bytes. field names and layouts
+# are interned: a 0 is followed by the definition, which gets the next index,
+# and anything else is that index + 1
+MAGIC = b'GCTRACE1'
+
+NEW = 1
+NEW_UNROOTED = 2
+SET_FIELD = 3
+DROP = 4
+ADD_ROOT = 5
+
+CHUNK_SIZE = 1 << 20
+
+
+class TraceWriter:
+    def __init__(self, out: BinaryIO):
+        self.out = out
+        self.buffer = bytearray(MAGIC)
+        self.names: Dict[str, int] = {}
+        self.layouts: Dict[Tuple[str, ...], int] = {}
+        self.records = 0
+
+    def new(self, obj_id: str, fields: Tuple[str, ...], rooted: bool):
+        self.buffer.append(NEW if rooted else NEW_UNROOTED)
+        self.string(obj_id)
+        index = self.layouts.get(fields)
+        if index is None:
+            self.layouts[fields] = len(self.layouts)
+            self.varint(0)
+            self.varint(len(fields))
+            for name in fields:
+                self.name(name)
+        else:
+            self.varint(index + 1)
+        self.written()
+
+    def set_field(self, src_id: str, field: str, target_id: Optional[str]):
+        self.buffer.append(SET_FIELD)
+        self.string(src_id)
+        self.name(field)
+        self.string(target_id)
+        self.written()
+
+    def drop(self, obj_id: str):
+        self.buffer.append(DROP)
+        self.string(obj_id)
+        self.written()
+
+    def add_root(self, obj_id: str):
+        self.buffer.append(ADD_ROOT)
+        self.string(obj_id)
+        self.written()
+
+    def varint(self, value: int):
+        while value >= 0x80:
+            self.buffer.append(value & 0x7f | 0x80)
+            value >>= 7
+        self.buffer.append(value)
+
+    def string(self, value: Optional[str]):
+        if value is None:
+            self.varint(0)
+            return
+        encoded = value.encode('utf-8')
+        self.varint(len(encoded) + 1)
+        self.buffer += encoded
+
+    def name(self, value: str):
+        index = self.names.get(value)
+        if index is None:
+            self.names[value] = len(self.names)
+            self.varint(0)
+            self.string(value)
+        else:
+            self.varint(index + 1)
+
+    def written(self):
+        self.records += 1
+        if len(self.buffer) >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.out.write(self.buffer)
+        self.buffer = bytearray()
+
+    def close(self):
+        self.flush()
+        self.out.flush()
+
+
+# decodes a trace a chunk at a time, so only the interned names and layouts
+# are kept around however long the trace is
+class TraceReader:
+    def __init__(self, source: BinaryIO):
+        self.source = source
+        self.data = b''
+        self.pos = 0
+        self.names: List[str] = []
+        self.layouts: List[List[str]] = []
+        if self.read(len(MAGIC)) != MAGIC:
+            raise ValueError('not a mutator trace')
+
+    def __iter__(self) -> Iterator[tuple]:
+        while self.fill(1):
+            op = self.data[self.pos]
+            self.pos += 1
+            if op == NEW or op == NEW_UNROOTED:
+                yield (op, self.string(), self.layout())
+            elif op == SET_FIELD:
+                yield (op, self.string(), self.name(), self.string())
+            elif op == DROP or op == ADD_ROOT:
+                yield (op, self.string())
+            else:
+                raise ValueError('unknown trace record: {}'.format(op))
+
+    # makes sure `n` unread bytes are buffered, false at the end of the trace
+    def fill(self, n: int) -> bool:
+        if len(self.data) - self.pos >= n:
+            return True
+        chunk = self.source.read(max(CHUNK_SIZE, n))
+        self.data = self.data[self.pos:] + chunk
+        self.pos = 0
+        return len(self.data) >= n
+
+    def read(self, n: int) -> bytes:
+        if not self.fill(n):
+            raise ValueError('trace ends in the middle of a record')
+        value = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return value
+
+    def varint(self) -> int:
+        value = 0
+        shift = 0
+        while True:
+            if not self.fill(1):
+                raise ValueError('trace ends in the middle of a record')
+            byte = self.data[self.pos]
+            self.pos += 1
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def string(self) -> Optional[str]:
+        length = self.varint()
+        if length == 0:
+            return None
+        return self.read(length - 1).decode('utf-8')
+
+    def name(self) -> str:
+        index = self.varint()
+        if index == 0:
+            self.names.append(self.string())
+            return self.names[-1]
+        return self.names[index - 1]
+
+    def layout(self) -> List[str]:
+        index = self.varint()
+        if index == 0:
+            self.layouts.append([self.name() for _ in range(self.varint())])
+            return self.layouts[-1]
+        return self.layouts[index - 1]
+
+
+# stands in for a runtime and writes down every mutator operation made on it,
+# everything else goes straight through to the runtime
+class Recorder:
+    def __init__(self, runtime, writer: TraceWriter):
+        self.runtime = runtime
+        self.writer = writer
+
+    def __getattr__(self, name: str):
+        return getattr(self.runtime, name)
+
+    def new(self, obj: Object) -> Reference:
+        ref = self.runtime.new(obj)
+        # the tracing runtimes root every new object, the reference counters don't
+        self.writer.new(obj.id, obj.layout.names, obj.id in self.runtime.roots)
+        return ref
+
+    def set_field(self, src: Reference, field: str, target: Reference):
+        src_id = self.runtime.read(src).id
+        target_id = self.runtime.read(target).id if target is not None else None
+        self.runtime.set_field(src, field, target)
+        self.writer.set_field(src_id, field, target_id)
+
+    def drop(self, obj_id: str):
+        self.runtime.drop(obj_id)
+        self.writer.drop(obj_id)
+
+    def add_root(self, ref: Reference):
+        obj_id = self.runtime.read(ref).id
+        self.runtime.add_root(ref)
+        self.writer.add_root(obj_id)
+
+
+# plays a trace back into `runtime` as it is read. objects are found through
+# the runtime's roots, so moving collectors always hand back a current
+# reference. objects the trace created unrooted are held as roots until they
+# are first stored somewhere and are looked up in `refs` after that, which is
+# only safe when the runtime doesn't move objects. traces recorded through
+# benchmark.Mutator root everything they go on using, so they replay anywhere
+class Replayer:
+    def __init__(self, runtime, allocated: Callable[[], None] = None):
+        self.runtime = runtime
+        self.allocated = allocated
+        self.refs: Dict[str, Reference] = {}
+        # unrooted in the trace but rooted by the runtime until first stored
+        self.floating = set()
+        self.operations = 0
+
+    def replay(self, reader: TraceReader) -> int:
+        for record in reader:
+            self.apply(record)
+        return self.operations
+
+    def apply(self, record: tuple):
+        op = record[0]
+        if op == NEW or op == NEW_UNROOTED:
+            self.new(record[1], record[2], op == NEW)
+        elif op == SET_FIELD:
+            self.set_field(record[1], record[2], record[3])
+        elif op == DROP:
+            self.drop(record[1])
+        else:
+            self.add_root(record[1])
+        self.operations += 1
+
+    def resolve(self, obj_id: Optional[str]) -> Optional[Reference]:
+        if obj_id is None:
+            return None
+        ref = self.runtime.roots.get(obj_id)
+        return ref if ref is not None else self.refs[obj_id]
+
+    def new(self, obj_id: str, fields: List[str], rooted: bool):
+        ref = self.runtime.new(Object(obj_id, fields))
+        if self.allocated is not None:
+            self.allocated()
+        if obj_id in self.runtime.roots:
+            if not rooted:
+                self.floating.add(obj_id)
+        elif rooted:
+            self.runtime.add_root(ref)
+        else:
+            self.refs[obj_id] = ref
+
+    def set_field(self, src_id: str, field: str, target_id: Optional[str]):
+        self.runtime.set_field(self.resolve(src_id), field, self.resolve(target_id))
+        if target_id in self.floating:
+            self.floating.discard(target_id)
+            self.refs[target_id] = self.runtime.roots[target_id]
+            self.runtime.drop(target_id)
+
+    def drop(self, obj_id: str):
+        self.floating.discard(obj_id)
+        self.refs.pop(obj_id, None)
+        self.runtime.drop(obj_id)
+
+    def add_root(self, obj_id: str):
+        self.floating.discard(obj_id)
+        if obj_id not in self.runtime.roots:
+            self.runtime.add_root(self.resolve(obj_id))
+        self.refs.pop(obj_id, None)
+
+
+def record(path: str, collector: str, workload: str, scale: int, heap_size: int, seed: int) -> int:
+    benchmark = importlib.import_module('benchmark')
+    module_name, options = benchmark.COLLECTORS[collector]
+    runtime = importlib.import_module(module_name).Runtime(heap_size = heap_size, heap_alignment = 1, **options)
+    with open(path, 'wb') as out:
+        writer = TraceWriter(out)
+        m = benchmark.Mutator(collector, Recorder(runtime, writer))
+        benchmark.WORKLOADS[workload](m, random.Random(seed), scale)
+        writer.close()
+    return writer.records
+
+def replay(path: str, runtime, allocated: Callable[[], None] = None) -> int:
+    with open(path, 'rb') as source:
+        return Replayer(runtime, allocated).replay(TraceReader(source))
+
+def main():
+    benchmark = importlib.import_module('benchmark')
+    parser = argparse.ArgumentParser(description = 'records benchmark workloads as mutator traces and replays them')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+
+    record_parser = commands.add_parser('record', help = 'run a workload and write its trace')
+    record_parser.add_argument('path')
+    record_parser.add_argument('--workload', choices = list(benchmark.WORKLOADS), default = 'random-dag')
+    record_parser.add_argument('--collector', choices = list(benchmark.COLLECTORS), default = 'mark-sweep')
+    record_parser.add_argument('--scale', type = int, default = benchmark.DEFAULT_SCALE)
+    record_parser.add_argument('--heap-size', type = int, default = benchmark.DEFAULT_HEAP_SIZE)
+    record_parser.add_argument('--seed', type = int, default = 0)
+
+    replay_parser = commands.add_parser('replay', help = 'replay a trace into every collector and compare them')
+    replay_parser.add_argument('path')
+    replay_parser.add_argument('--collectors', nargs = '+', choices = list(benchmark.COLLECTORS), default = list(benchmark.COLLECTORS))
+    replay_parser.add_argument('--heap-size', type = int, default = benchmark.DEFAULT_HEAP_SIZE)
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        records = record(args.path, args.collector, args.workload, args.scale, args.heap_size, args.seed)
+        print('recorded {} operations to {}'.format(records, args.path))
+    else:
+        benchmark.report([benchmark.run(collector, 'trace', heap_size = args.heap_size, trace = args.path)
+                          for collector in args.collectors])
+
+if __name__ == "__main__":
+    main()